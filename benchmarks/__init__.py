@@ -0,0 +1,9 @@
+"""Benchmarks for the game's hot paths.
+
+The suite in `benchmarks.suite` runs with fixed seeds and writes JSON:
+`python -m benchmarks run -o out.json`, then
+`python -m benchmarks compare base.json out.json` flags regressions.
+
+The other modules are standalone comparisons that can be run on their
+own, e.g. `python -m benchmarks.level_index`.
+"""
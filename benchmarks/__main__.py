@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Runs the benchmark suite, or compares two of its runs.
+
+Examples:
+    python -m benchmarks run -o before.json
+    python -m benchmarks run -o after.json lookup move
+    python -m benchmarks compare before.json after.json
+"""
+import argparse
+import json
+import sys
+
+from benchmarks.suite import BENCHMARKS, run, compare
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+    run_parser = commands.add_parser("run", help="run benchmarks")
+    run_parser.add_argument("names", nargs="*", metavar="name", help="benchmarks to run (default: all of {})".format(", ".join(BENCHMARKS)))
+    run_parser.add_argument("-o", "--output", type=argparse.FileType("w"), default=sys.stdout, help="JSON output file (default: stdout)")
+    run_parser.add_argument("--seed", type=int, default=0)
+    compare_parser = commands.add_parser("compare", help="flag regressions between two runs")
+    compare_parser.add_argument("base", type=argparse.FileType("r"))
+    compare_parser.add_argument("new", type=argparse.FileType("r"))
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown counted as a regression (default: 0.1)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        unknown = [name for name in args.names if name not in BENCHMARKS]
+        if unknown:
+            parser.error("unknown benchmarks: {}".format(", ".join(unknown)))
+        json.dump(run(args.names or list(BENCHMARKS), args.seed), args.output, indent=2)
+        args.output.write("\n")
+    elif args.command == "compare":
+        rows = compare(json.load(args.base), json.load(args.new), args.threshold)
+        print("{:<28}{:>14}{:>14}{:>9}".format("metric", "base (us)", "new (us)", "change"))
+        for metric, before, after, regressed in rows:
+            print("{:<28}{:>14.2f}{:>14.2f}{:>+8.0%}{}".format(
+                metric, before * 1e6, after * 1e6, after / before - 1, "  REGRESSION" if regressed else ""))
+        return int(any(row[3] for row in rows))
+    else:
+        parser.print_help()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Corridor generation: networkx A* against the occupancy-grid A*.
+
+Both factories connect the same rooms: for every seed, the rooms
+are placed once per factory from the same random stream.
+
+Usage: python -m benchmarks.corridors [levels]
+"""
+import sys
+from time import perf_counter
+
+from models.level import Level, CorridorFactory, GridCorridorFactory, ICorridorFactory
+from rnd.dice import Rng
+
+def time_factory(factory: ICorridorFactory, levels: int) -> float:
+    """Returns the average time (in milliseconds) of `factory.make_corridors`."""
+    total = 0
+    for seed in range(levels):
+        level = Level(corridors=[], rng=Rng(seed))
+        rng = Rng(seed).split("corridors")
+        start = perf_counter()
+        factory.make_corridors(level, rng)
+        total += perf_counter() - start
+    return total / levels * 1e3
+
+def run(levels: int = 100):
+    before = time_factory(CorridorFactory(), levels)
+    after = time_factory(GridCorridorFactory(), levels)
+    print("{:<22}{:>10.2f} ms".format("CorridorFactory", before))
+    print("{:<22}{:>10.2f} ms".format("GridCorridorFactory", after))
+    print("{:<22}{:>10.1f}x".format("speedup", before / after))
+
+if __name__ == '__main__':
+    run(*map(int, sys.argv[1:]))
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Dice rolls: one `randint` per die against Rng.d and Rng.roll_many.
+
+Usage: python -m benchmarks.dice [rolls]
+"""
+import sys
+from random import Random
+from time import perf_counter
+
+from rnd.dice import Rng
+
+def run(rolls: int = 100000):
+    rng = Rng(0)
+    rng.roll_many(1, 6, 1)  # Imports NumPy outside of the timed section
+    legacy = Random(0)
+    print("{:<28}{:>12}".format("3d6", "rolls/s"))
+    for name, roll in (
+            ("randint per die", lambda: [sum(legacy.randint(1, 6) for __ in range(3)) for __ in range(rolls)]),
+            ("Rng.d", lambda: [rng.d(3, 6) for __ in range(rolls)]),
+            ("Rng.roll_many", lambda: rng.roll_many(3, 6, rolls))):
+        start = perf_counter()
+        roll()
+        print("{:<28}{:>12.0f}".format(name, rolls / (perf_counter() - start)))
+
+if __name__ == '__main__':
+    run(*map(int, sys.argv[1:]))
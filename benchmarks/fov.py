@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Field of view queries per second, with a cold and a warm cache.
+
+Usage: python -m benchmarks.fov [queries] [radius]
+"""
+import sys
+from time import perf_counter
+
+from models.level import Level
+from rnd.dice import Rng
+
+def run(queries: int = 2000, radius: int = 20):
+    rng = Rng(0)
+    levels = [Level(rng=Rng(seed)) for seed in range(10)]
+    origins = [(level, level.get_random_walkable(rng=rng)) for level in levels for __ in range(queries // len(levels))]
+    print("{:<20}{:>12}".format("radius {}".format(radius), "queries/s"))
+    start = perf_counter()
+    for level, pos in origins:
+        level.fov._cache.clear()
+        level.fov.visible(pos, radius)
+    print("{:<20}{:>12.0f}".format("cold cache", len(origins) / (perf_counter() - start)))
+    for level, pos in origins:
+        level.fov.visible(pos, radius)
+    start = perf_counter()
+    for level, pos in origins:
+        level.fov.visible(pos, radius)
+    print("{:<20}{:>12.0f}".format("warm cache", len(origins) / (perf_counter() - start)))
+
+if __name__ == '__main__':
+    run(*map(int, sys.argv[1:]))
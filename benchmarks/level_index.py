@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Per-move latency of the Level square index.
+
+Compares the dense grid index against the old implementation, which
+scanned every room and corridor on each lookup. Two kinds of level
+are measured: regular 9-room levels and a synthetic level tiled with
+hundreds of tiny rooms.
+
+Usage: python -m benchmarks.level_index [moves]
+"""
+import sys
+from contextlib import contextmanager
+from time import perf_counter
+
+from models.direction import Direction
+from models.level import Level, Room
+from models.player import Player
+from models.position import position
+from rnd.dice import Rng
+
+def _scan_getitem(level, pos):
+    """Level.__getitem__ before the grid index."""
+    for feature in level.features:
+        try:
+            return feature[pos]
+        except KeyError:
+            continue
+    raise KeyError(pos)
+
+def _scan_locate(level, pos):
+    """Level.locate before the grid index."""
+    for feature in level.features:
+        if pos in feature:
+            return feature
+    return None
+
+@contextmanager
+def legacy_lookup():
+    """Temporarily restores the linear-scan lookup on Level."""
+    getitem, locate = Level.__getitem__, Level.locate
+    Level.__getitem__, Level.locate = _scan_getitem, _scan_locate
+    try:
+        yield
+    finally:
+        Level.__getitem__, Level.locate = getitem, locate
+
+def regular_level(seed: int) -> Level:
+    return Level(rng=Rng(seed))
+
+def crowded_level() -> Level:
+    """A level made of 350 2x2 rooms plus a room to walk in.
+
+    The walkable room comes last, so a linear scan has to go through
+    every other feature before finding it."""
+    rooms = [Room(position(col, row), 2, 2) for col in range(0, 70, 2) for row in range(0, 20, 2)]
+    rooms.append(Room(position(71, 0), 8, 6))
+    return Level(rooms, [])
+
+def per_move(level: Level, moves: int, seed: int = 0) -> float:
+    """Returns the average time (in microseconds) of Player.move."""
+    rnd = Rng(seed)
+    player = Player.create(level, level.rooms[-1].get_random_walkable())
+    player.health.max_hp = player.health.current_hp = float("inf")
+    directions = list(Direction)
+    steps = [rnd.choice(directions) for __ in range(moves)]
+    start = perf_counter()
+    for direction in steps:
+        player.move(direction)
+    return (perf_counter() - start) / moves * 1e6
+
+def run(moves: int = 20000):
+    print("{:<12}{:>14}{:>14}{:>10}".format("level", "scan (us)", "index (us)", "speedup"))
+    for level in (regular_level(7), crowded_level()):
+        name = "{} rooms".format(len(level.rooms))
+        with legacy_lookup():
+            before = per_move(level, moves)
+        after = per_move(level, moves)
+        print("{:<12}{:>14.2f}{:>14.2f}{:>9.1f}x".format(name, before, after, before / after))
+
+if __name__ == '__main__':
+    run(*map(int, sys.argv[1:]))
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""Benchmark suite for the game's hot paths.
+
+Every benchmark is a function registered with `@benchmark`. It receives
+a seed, builds whatever it needs from it, and returns a mapping from
+metric names to seconds per operation. Results are written as JSON,
+so that two runs can be compared with `compare`.
+"""
+import platform
+import subprocess
+import sys
+from collections import OrderedDict
+from itertools import count
+from time import perf_counter, strftime
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from helpers.commands import Move
+from helpers.i18n import EnglishDescriptionFactory
+from helpers.skills import Inventory
+from helpers.validation import validate, _cerberus
+from models.direction import Direction
+from models.game import Game, LevelSupply
+from models.items import HealingPotion, HealingScroll, Beatitude
+from models.level import Level, GridCorridorFactory, RejectionRoomPlacer
+from models import savegame
+from models.player import Creature, Player
+from models.scheduler import ACTION_COST, Scheduler
+from models.visibility import offsets
+from rnd.dice import Rng
+
+FORMAT_VERSION = 1
+"""Version of the JSON output."""
+
+BENCHMARKS = OrderedDict()  # type: Dict[str, Callable[[int], Dict[str, float]]]
+"""Registered benchmarks, by name."""
+
+def benchmark(func: Callable[[int], Dict[str, float]]) -> Callable[[int], Dict[str, float]]:
+    """Registers a benchmark."""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+def per_op(func: Callable[[], object], number: int, repeat: int = 5) -> float:
+    """Returns the best time per call of `func`, over `repeat` runs of `number` calls."""
+    best = float("inf")
+    for __ in range(repeat):
+        start = perf_counter()
+        for __ in range(number):
+            func()
+        best = min(best, perf_counter() - start)
+    return best / number
+
+def each(items: List, func: Callable, repeat: int = 5) -> float:
+    """Returns the best time per item of calling `func` on every item in `items`."""
+    best = float("inf")
+    for __ in range(repeat):
+        start = perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, perf_counter() - start)
+    return best / len(items)
+
+def _game(seed: int) -> Game:
+    return Game(EnglishDescriptionFactory(), seed, LevelSupply(seed, workers=0))
+
+@benchmark
+def level(seed: int) -> Dict[str, float]:
+    """Level construction, split into room placement (with the default
+    placer and with rejection sampling) and corridor creation."""
+    rng = Rng(seed)
+    seeds = count()
+    rooms = per_op(lambda: Level(corridors=[], rng=rng.split(next(seeds))), 20, 3)
+    rejection = RejectionRoomPlacer()
+    rooms_rejection = per_op(lambda: Level(corridors=[], rng=rng.split(next(seeds)), room_placer=rejection), 20, 3)
+    factory = GridCorridorFactory()
+    total = 0
+    for i in range(20):
+        lvl = Level(corridors=[], rng=rng.split(i))
+        start = perf_counter()
+        factory.make_corridors(lvl, rng.split((i, "corridors")))
+        total += perf_counter() - start
+    return {"rooms": rooms, "rooms_rejection": rooms_rejection, "corridors": total / 20}
+
+@benchmark
+def lookup(seed: int) -> Dict[str, float]:
+    """Level.__getitem__ and Level.locate, on positions that hold a square."""
+    rng = Rng(seed)
+    lvl = Level(rng=rng)
+    squares = [pos for pos, __ in lvl.squares()]
+    positions = [rng.choice(squares) for __ in range(2000)]
+    return {
+        "getitem": each(positions, lvl.__getitem__),
+        "locate": each(positions, lvl.locate),
+    }
+
+@benchmark
+def move(seed: int) -> Dict[str, float]:
+    """Player.move, which includes Player.update_lights."""
+    rng = Rng(seed)
+    lvl = Level(rng=rng)
+    player = Player.create(lvl, lvl.get_random_walkable(rng=rng))
+    player.health.max_hp = player.health.current_hp = float("inf")
+    steps = [rng.choice(list(Direction)) for __ in range(2000)]
+    return {
+        "move": each(steps, player.move),
+        "update_lights": per_op(player.update_lights, 2000),
+    }
+
+@benchmark
+def dispatch(seed: int) -> Dict[str, float]:
+    """Game.add_command, with random moves."""
+    rng = Rng(seed)
+    game = _game(seed)
+    game.player.health.max_hp = game.player.health.current_hp = float("inf")
+    commands = [Move(rng.choice(list(Direction))) for __ in range(2000)]
+    def send(cmd):
+        game.add_command(cmd)
+        game.messages.clear()
+    return {"move": each(commands, send)}
+
+@benchmark
+def inventory(seed: int) -> Dict[str, float]:
+    """Inventory operations on a full inventory."""
+    rng = Rng(seed)
+    descriptions = EnglishDescriptionFactory(rng)
+    items = [rng.choice((HealingPotion, HealingScroll))() for __ in range(len(Inventory._letters))]
+    inv = Inventory()
+    for item in items:
+        inv.add(item)
+    def cycle(item):
+        inv.remove(item)
+        inv.add(item)
+    return {
+        "add_remove": each(items, cycle),
+        "sorted": per_op(inv.sorted, 200),
+        "filter": per_op(lambda: inv.filter(HealingPotion.category), 200),
+        "get_view": per_op(lambda: inv.get_view(descriptions.describe), 200),
+    }
+
+@benchmark
+def describe(seed: int) -> Dict[str, float]:
+    """EnglishDescriptionFactory.describe, on known and unknown items."""
+    rng = Rng(seed)
+    descriptions = EnglishDescriptionFactory(rng)
+    items = []
+    for __ in range(1000):
+        item = rng.choice((HealingPotion, HealingScroll))()
+        item.beatitude = rng.choice(list(Beatitude))
+        item.beatitude_known = rng.coin()
+        items.append(item)
+    unknown = each(items, descriptions.describe)
+    descriptions.known_items.update((HealingPotion, HealingScroll))
+    return {"unknown": unknown, "known": each(items, descriptions.describe)}
+
+class Wanderer(Creature):
+    """A creature that steps in a random direction, if it can."""
+    def __init__(self, level: Level, pos, rng: Rng):
+        super().__init__(level, pos)
+        self.rng = rng
+
+    def act(self, game):
+        new_pos = self.pos + self.rng.choice(_DIRECTIONS).value
+        feature = self.level.locate(new_pos)
+        if feature is not None and feature[new_pos].is_walkable:
+            self.pos = new_pos
+        return ACTION_COST
+
+_DIRECTIONS = list(Direction)
+
+@benchmark
+def visibility(seed: int) -> Dict[str, float]:
+    """Room.switch_lights on the rooms of a level, and listing the squares
+    that changed since a snapshot of its Visibility layer (all of them)."""
+    lvl = Level(rng=Rng(seed))
+    rooms = list(lvl.rooms)
+    layer = lvl.visibility
+    snapshot = layer.snapshot()
+    def switch(room):
+        room.switch_lights(True)
+        room.switch_lights(False)
+    return {
+        "switch": each(rooms, switch) / 2,
+        "changed": per_op(lambda: list(offsets(layer.changed(snapshot))), 100),
+    }
+
+@benchmark
+def items(seed: int) -> Dict[str, float]:
+    """ItemLayer queries on a level with 50 items on random squares:
+    lookups on every square, items in each room, items in view of the
+    whole level, and dropping then picking up an item."""
+    rng = Rng(seed)
+    lvl = Level(rng=rng)
+    squares = [pos for pos, __ in lvl.squares()]
+    for __ in range(50):
+        lvl.items.add(rng.choice(squares), HealingPotion())
+    rooms = list(lvl.rooms)
+    view = lvl.mask()
+    pos = squares[0]
+    def drop():
+        lvl.items.add(pos, HealingPotion())
+        lvl.items.pop(pos)
+    return {
+        "at": each(squares, lvl.items.at),
+        "in_rect": each(rooms, lambda room: list(lvl.items.in_rect(room.bbox))),
+        "in_view": per_op(lambda: list(lvl.items.in_mask(view)), 1000),
+        "drop": per_op(drop, 1000),
+    }
+
+@benchmark
+def schedule(seed: int) -> Dict[str, float]:
+    """Scheduler.run on 10000 wandering creatures of mixed speeds, one tick at a time."""
+    rng = Rng(seed)
+    lvl = Level(rng=rng)
+    scheduler = Scheduler()
+    creatures = []
+    for __ in range(10000):
+        creature = Wanderer(lvl, lvl.get_random_walkable(rng=rng), rng)
+        creature.speed = rng.choice((6, 12, 12, 24))
+        scheduler.add(creature, rng.randrange(2))
+        creatures.append(creature)
+    ticks = count(1)
+    def churn(creature):
+        scheduler.remove(creature)
+        scheduler.add(creature, 1)
+    return {
+        "tick": per_op(lambda: scheduler.run(None, until=next(ticks)), 5, 3),
+        "remove_add": each(rng.sample(creatures, 2000), churn),
+    }
+
+@benchmark
+def distance(seed: int) -> Dict[str, float]:
+    """Distance maps to a goal taking a random walk: full builds, one-square
+    updates and next-step lookups.
+
+    Also checks that the updated map matches one built from scratch."""
+    rng = Rng(seed)
+    lvl = Level(rng=rng)
+    maps = lvl.distances
+    goal = lvl.get_random_walkable(rng=rng)
+    path = [goal]
+    while len(path) < 500:
+        new_pos = path[-1] + rng.choice(_DIRECTIONS).value
+        feature = lvl.locate(new_pos)
+        if feature is not None and feature[new_pos].is_walkable:
+            path.append(new_pos)
+    walkable = [pos for pos, square in lvl.squares() if square.is_walkable]
+    dmap = maps.get("goal", (goal,))
+    update = each(path[1:], lambda pos: maps.get("goal", (pos,)), 1)
+    fresh = maps.get("fresh", (path[-1],))
+    if any(dmap.distance(pos) != fresh.distance(pos) for pos in walkable):
+        raise AssertionError("Updated distance map differs from a full build")
+    return {
+        "build": per_op(lambda: dmap.reset(frozenset((goal,))), 50),
+        "update": update,
+        "step": each(walkable, dmap.step),
+    }
+
+@benchmark
+def validation(seed: int) -> Dict[str, float]:
+    """A two-argument function validated like `position`: unwrapped (as under
+    `python -O`), with the compiled checker, and with a Cerberus Validator."""
+    schema = {
+        0: {'type': 'integer', 'min': 0, 'max': 78},
+        1: {'type': 'integer', 'min': 0, 'max': 20},
+    }
+    def func(col, row):
+        return col, row
+    rng = Rng(seed)
+    args = [(rng.randrange(79), rng.randrange(21)) for __ in range(1000)]
+    result = {}
+    for mode, wrapped in (("off", validate(schema, enabled=False)(func)),
+                          ("compiled", validate(schema, enabled=True)(func)),
+                          ("cerberus", _cerberus(schema, func))):
+        result[mode] = each(args, lambda a: wrapped(*a), 3 if mode == "cerberus" else 5)
+    return result
+
+class OffscreenScreen():
+    """The subset of asciimatics' Screen used by MapBox. Draws nothing."""
+    def __init__(self):
+        self.print_calls = 0
+    def print_at(self, text, x, y, colour=7, attr=0, bg=0, transparent=False):
+        self.print_calls += 1
+
+@benchmark
+def render(seed: int) -> Dict[str, float]:
+    """MapBox.draw_level on an off-screen screen: full repaints and single moves."""
+    from ui.text_interface import MapBox
+    rng = Rng(seed)
+    game = _game(seed)
+    game.player.health.max_hp = game.player.health.current_hp = float("inf")
+    for pos, square in game.player.level.squares():
+        square.known = True
+    box = MapBox(OffscreenScreen(), (0, 1), game)
+    def full():
+        box.buffer.invalidate()
+        box.update(0)
+    steps = [Move(rng.choice(list(Direction))) for __ in range(500)]
+    def step(cmd):
+        game.add_command(cmd)
+        game.messages.clear()
+        box.update(0)
+    moves = each(steps, step, 1)
+    return {"full": per_op(full, 50), "move": moves}
+
+@benchmark
+def save(seed: int) -> Dict[str, float]:
+    """savegame.dumps and savegame.loads on a game that went down 10 levels.
+
+    Also checks that a loaded game saves to the same bytes."""
+    game = _game(seed)
+    for __ in range(10):
+        game.descend()
+    data = savegame.dumps(game)
+    if savegame.dumps(savegame.loads(data, EnglishDescriptionFactory())) != data:
+        raise AssertionError("Loaded game differs from the saved one")
+    def load_all():
+        for __ in savegame.loads(data, EnglishDescriptionFactory()).levels:
+            pass
+    return {
+        "dumps": per_op(lambda: savegame.dumps(game), 10),
+        "loads": per_op(lambda: savegame.loads(data, EnglishDescriptionFactory()), 50),
+        "loads_all": per_op(load_all, 10),
+    }
+
+_FIRST_FRAME = """
+import sys
+from helpers.i18n import EnglishDescriptionFactory
+from models.game import Game, LevelSupply
+from ui.text_interface import MapBox
+class Screen():
+    def print_at(self, *args, **kwargs):
+        pass
+game = Game(EnglishDescriptionFactory(), {seed}, LevelSupply({seed}, workers=0))
+MapBox(Screen(), (0, 1), game).update(0)
+print(" ".join(sorted({{"networkx", "cerberus", "numpy"}} & set(sys.modules))))
+"""
+"""Builds a game and draws its map once, headless."""
+
+@benchmark
+def startup(seed: int) -> Dict[str, float]:
+    """Fresh interpreters: bare, importing the game's modules, and drawing the first frame.
+
+    Also checks that no heavy optional dependency is imported on the way."""
+    def python(code):
+        return subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE,
+                              universal_newlines=True, check=True).stdout
+    heavy = python(_FIRST_FRAME.format(seed=seed)).strip()
+    if heavy:
+        raise AssertionError("Imported at startup: {}".format(heavy))
+    return {
+        "interpreter": per_op(lambda: python("pass"), 1, 5),
+        "imports": per_op(lambda: python("import models.game, models.replay, ui.text_interface"), 1, 5),
+        "first_frame": per_op(lambda: python(_FIRST_FRAME.format(seed=seed)), 1, 5),
+    }
+
+def run(names: Iterable[str], seed: int = 0) -> Dict:
+    """Runs the given benchmarks and returns the results as a JSON-serializable dict."""
+    results = OrderedDict()
+    for name in names:
+        for metric, seconds in BENCHMARKS[name](seed).items():
+            results["{}.{}".format(name, metric)] = seconds
+    return {
+        "version": FORMAT_VERSION,
+        "seed": seed,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+def compare(base: Dict, new: Dict, threshold: float = 0.1) -> List[Tuple[str, float, float, bool]]:
+    """Compares two runs.
+
+    Returns a list of (metric, base seconds, new seconds, regressed),
+    where a metric regressed if it got slower by more than `threshold`
+    (relative). Metrics missing from either run are skipped."""
+    rows = []
+    for metric, before in base["results"].items():
+        after = new["results"].get(metric)
+        if after is not None:
+            rows.append((metric, before, after, after > before * (1 + threshold)))
+    return rows
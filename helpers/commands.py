@@ -1,95 +1,164 @@
-from typing import Tuple, List, Optional
+from collections import namedtuple
+from typing import Dict, Tuple, Optional, Sequence
 from models.player import Player
 from helpers.exceptions import EmptyInventoryException
+from helpers.registry import register
+from models.events import HealthChanged, ItemIdentified, ItemPickedUp, LightsChanged, Moved
+from models.scheduler import ACTION_COST
 
 class Command():
-    """Minimal implementation of the Command design pattern."""
+    """Minimal implementation of the Command design pattern.
+
+    Commands are immutable records: the same instance can be dispatched
+    any number of times, by any number of games. The game is passed to
+    `execute` instead of being stored in the command."""
+    __slots__ = ()
     verb = None
-    def __init__(self):
-        self.game = None
-    def execute(self) -> Optional[List['Command']]:
-        """Excecutes the command."""
+    cost = 0
+    """Energy the player spends when issuing the command. Commands that
+    cost nothing don't let the other creatures act."""
+    logged = True
+    """When False, the command doesn't change the game's state, and
+    command logs skip it."""
+    registry = {}   # type: Dict[int, type]
+    """Every command class, by `registry_id`.
+
+    Command logs store the ids, so each subclass declares its own (e.g.
+    `class Move(Command, registry_id=0)`), and ids must never be changed
+    or reused. Logs store them in one byte, and 255 is reserved."""
+
+    def __init_subclass__(cls, registry_id: Optional[int] = None, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.registry_id = register(Command.registry, cls, registry_id)
+
+    def execute(self, game: 'Game') -> Optional[Sequence['Command']]:
+        """Excecutes the command.
+
+        Returns the follow-up commands, which are run next, in order."""
         raise NotImplementedError("This is an abstract class.")
 
-class Move(Command):
-    def __init__(self, direction: 'Direction'):
-        self.direction = direction
- 
-    def execute(self):
-        self.game.player.move(self.direction)
-        items = self.game.player.square.items
-        msg = None
+class Move(Command, namedtuple("Move", "direction"), registry_id=0):
+    __slots__ = ()
+    cost = ACTION_COST
+    def execute(self, game):
+        player = game.player
+        old_pos, old_hp = player.pos, player.health.current_hp
+        changed = player.move(self.direction)
+        if player.pos != old_pos:
+            game.events.publish(Moved(player, old_pos, player.pos))
+        if changed:
+            game.events.publish(LightsChanged(player.level, changed))
+        if player.health.current_hp != old_hp:
+            game.events.publish(HealthChanged(player, old_hp, player.health.current_hp))
+        items = player.level.items.at(player.pos)
         if len(items) == 1:
-            return [AddMessage("You see here {}.".format(self.game.descriptions.describe(items[0])))]
+            return (AddMessage("You see here {}.".format(game.descriptions.describe(items[0]))),)
         elif len(items) > 1:
-            return [AddPopup("Things that are here:", (self.game.descriptions.describe(i) for i in items))]
+            return (AddPopup("Things that are here:", tuple(game.descriptions.describe(i) for i in items)),)
 
-class AddInventoryQuery(Command):
-    def __init__(self, callback: type(Command), filter: 'Item' = None):
-        self.callback = callback
-        self.filter = filter
-    def execute(self):
+class AddInventoryQuery(Command, namedtuple("AddInventoryQuery", "callback filter"), registry_id=1):
+    __slots__ = ()
+    def __new__(cls, callback: type(Command), filter: 'Item' = None):
+        return super().__new__(cls, callback, filter)
+    def execute(self, game):
         try:
-            self.game.add_inventory_query(self.callback, self.filter)
+            game.add_inventory_query(self.callback, self.filter)
         except EmptyInventoryException as exc:
-            return [AddMessage(str(exc))]
+            return (AddMessage(str(exc)),)
 
-class Quaff(Command):
+class Quaff(Command, namedtuple("Quaff", "potion"), registry_id=2):
+    __slots__ = ()
     verb = "to drink"
-    def __init__(self, potion: 'Potion'):
-        self.potion = potion
-    def execute(self):
-        if self.potion.auto_discovery:
-            self.game.descriptions.known_items.add(type(self.potion))
-        self.game.destroy_item(self.potion)
-        return [self.potion.effect(self.game.player)]
-
-class Pickup(Command):
-    def execute(self):
-        square = self.game.player.square
-        if not square.items:
-            self.game.messages.appendleft("There is nothing here to pick up.")
-        elif len(square.items) == 1:
-            item = square.items.pop()
-            slot = self.game.player.inventory.add(item)
+    cost = ACTION_COST
+    def execute(self, game):
+        if self.potion.auto_discovery and type(self.potion) not in game.descriptions.known_items:
+            game.descriptions.known_items.add(type(self.potion))
+            game.events.publish(ItemIdentified(type(self.potion)))
+        game.destroy_item(self.potion)
+        effect = self.potion.effect(game.player)
+        if effect is not None:
+            return (effect,)
+
+class Pickup(Command, registry_id=3):
+    __slots__ = ()
+    cost = ACTION_COST
+    def execute(self, game):
+        player = game.player
+        items = player.level.items.at(player.pos)
+        if not items:
+            return NOTHING_TO_PICK_UP
+        elif len(items) == 1:
+            item = player.level.items.pop(player.pos)
+            slot = game.player.inventory.add(item)
             if slot:
-                self.game.messages.appendleft("{} - {}".format(slot, self.game.descriptions.describe(item)))
+                game.events.publish(ItemPickedUp(game.player, item, slot))
+                return (AddMessage("{} - {}".format(slot, game.descriptions.describe(item))),)
 
-class ShowInventory(Command):
-    def execute(self):
-        inv = self.game.player.inventory.sorted()
+class ShowInventory(Command, registry_id=4):
+    __slots__ = ()
+    def execute(self, game):
+        inv = game.player.inventory.sorted()
         if inv:
             lines = []
-            descriptions = self.game.descriptions
+            descriptions = game.descriptions
             for cat, items in inv.items():
                 lines.append(descriptions.plurals[cat].capitalize())
                 lines.extend(
                     items.get_view(descriptions.describe).keys()
                 )
-            return [AddPopup("Your inventory:", sorted(lines))]
+            return (AddPopup("Your inventory:", sorted(lines)),)
+        else:
+            return INVENTORY_EMPTY
+
+class Descend(Command, registry_id=5):
+    __slots__ = ()
+    cost = ACTION_COST
+    def execute(self, game):
+        game.descend()
+
+class ShowCommandStats(Command, registry_id=6):
+    __slots__ = ()
+    logged = False
+    def execute(self, game):
+        if game.stats is None:
+            game.enable_stats()
+            return (AddMessage("Command statistics enabled."),)
+        elif game.stats.calls:
+            return (AddPopup("Command statistics:", game.stats.lines()),)
         else:
-            return [AddMessage("Your inventory is empty.")]
-
-class AddMessage(Command):
-    def __init__(self, msg: str):
-        self.msg = msg
-    def execute(self):
-        self.game.add_message(self.msg)
-
-class AddPopup(Command):
-    def __init__(self, title: str, body: List[str]):
-        self.title = title
-        self.body = body
-    def execute(self):
-        self.game.add_popup(self.title, self.body)
-
-class Heal(Command):
-    def __init__(self, creature: 'Creature', points: int):
-        self.creature = creature
-        self.points = points
-    def execute(self):
-        self.creature.health.heal(self.points)
+            return (AddMessage("No commands recorded yet."),)
+
+class ProfileNextTurn(Command, namedtuple("ProfileNextTurn", "path"), registry_id=7):
+    __slots__ = ()
+    logged = False
+    def execute(self, game):
+        game.profile_next_turn(self.path)
+        return (AddMessage("The next turn will be profiled to {}.".format(self.path)),)
+
+class AddMessage(Command, namedtuple("AddMessage", "msg"), registry_id=8):
+    __slots__ = ()
+    def execute(self, game):
+        game.add_message(self.msg)
+
+class AddPopup(Command, namedtuple("AddPopup", "title body"), registry_id=9):
+    __slots__ = ()
+    def execute(self, game):
+        game.add_popup(self.title, self.body)
+
+class Heal(Command, namedtuple("Heal", "creature points"), registry_id=10):
+    __slots__ = ()
+    def execute(self, game):
+        health = self.creature.health
+        old_hp = health.current_hp
+        health.heal(self.points)
+        game.events.publish(HealthChanged(self.creature, old_hp, health.current_hp))
         if isinstance(self.creature, Player):
-            return [AddMessage("You feel better.")]
+            return FEEL_BETTER
         else:
-            return [AddMessage("{} looks better.",format(creature.name))]
\ No newline at end of file
+            return (AddMessage("{} looks better.".format(self.creature.name)),)
+
+# Shared follow-ups, so that common outcomes don't allocate
+NEVER_MIND = (AddMessage("Never mind."),)
+NOTHING_TO_PICK_UP = (AddMessage("There is nothing here to pick up."),)
+INVENTORY_EMPTY = (AddMessage("Your inventory is empty."),)
+FEEL_BETTER = (AddMessage("You feel better."),)
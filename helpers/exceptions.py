@@ -1,2 +1,10 @@
 class EmptyInventoryException(BaseException):
-    pass
\ No newline at end of file
+    pass
+
+class ValidationError(ValueError):
+    """Raised when the arguments of a function don't match its schema.
+
+    `errors` maps the index of each invalid argument to a list of messages."""
+    def __init__(self, errors: dict):
+        super().__init__(errors)
+        self.errors = errors
@@ -12,16 +12,99 @@ This module provides a Factory class which stores and retrieves
 names for items
 """
 
+from collections.abc import MutableSet
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
 from models.items import *
-from random import randrange
+from rnd.dice import Rng, global_rng
+
+class KnownItems(MutableSet):
+    """Set of identified item types that counts its changes."""
+    def __init__(self, items: Iterable[type] = ()):
+        self._items = set(items)
+        self.version = 0
+        """Incremented whenever a type is added or removed."""
+
+    def __contains__(self, cls) -> bool:
+        return cls in self._items
+
+    def __iter__(self) -> Iterator[type]:
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, cls: type) -> None:
+        if cls not in self._items:
+            self._items.add(cls)
+            self.version += 1
+
+    def discard(self, cls: type) -> None:
+        if cls in self._items:
+            self._items.remove(cls)
+            self.version += 1
+
+    def update(self, *others: Iterable[type]) -> None:
+        for other in others:
+            for cls in other:
+                self.add(cls)
 
 class DescriptionFactory():
-    def __init__(self):
-        self.unknown_items = self.random_pairing()
-        self.known_items = set()
+    """Base class for the description factories of each language.
 
-    def describe(self, item: Item):
+    Subclasses implement `_describe`. `describe` caches its results by
+    item type, beatitude, beatitude knowledge and identification, so
+    each name is only built once per pairing."""
+    def __init__(self, rng: Optional[Rng] = None):
+        self._changes = 0
+        """Incremented whenever the pairing or the set of known items is replaced."""
+        self.known_items = KnownItems()
+        self._cache = {}
+        self.shuffle(rng or global_rng)
+
+    @property
+    def known_items(self) -> KnownItems:
+        """Identified item types."""
+        return self._known_items
+
+    @known_items.setter
+    def known_items(self, items: Iterable[type]) -> None:
+        self._known_items = items if isinstance(items, KnownItems) else KnownItems(items)
+        self._changes += 1
+
+    @property
+    def unknown_items(self) -> Dict[type, str]:
+        """Names of unidentified item types, by type."""
+        return self._unknown_items
+
+    @unknown_items.setter
+    def unknown_items(self, pairing: Dict[type, str]) -> None:
+        self._unknown_items = pairing
+        self._cache.clear()
+        self._changes += 1
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        """Changes whenever the name of some item may have changed. Only
+        compare versions for equality."""
+        return self._changes, self._known_items.version
+
+    def shuffle(self, rng: Rng) -> None:
+        """Draws a new description-to-item pairing from `rng`."""
+        self.unknown_items = self.random_pairing(rng)
+
+    def describe(self, item: Item) -> str:
         """Returns the name of the item."""
+        cls = type(item)
+        key = cls, item.beatitude, item.beatitude_known, cls in self.known_items
+        try:
+            return self._cache[key]
+        except KeyError:
+            name = self._cache[key] = self._describe(item)
+            return name
+
+    def _describe(self, item: Item) -> str:
+        """Builds the name of the item."""
         raise NotImplementedError("This is an abstract class.")
 
     def _add_article(self, s: str) -> str:
@@ -67,7 +150,7 @@ class EnglishDescriptionFactory(DescriptionFactory):
             "category": self.names[item.category]
         }
 
-    def describe(self, item: Item):
+    def _describe(self, item: Item):
         if type(item) in self.known_items:
             template = self.known
         else:
@@ -83,11 +166,11 @@ class EnglishDescriptionFactory(DescriptionFactory):
         else:
             return "a " + s
 
-    def random_pairing(self):
+    def random_pairing(self, rng: Rng):
         """Generates a random description-to-item pairing."""
         result = {}
         for cls in (Potion, Scroll):
-            for key in cls.__subclasses__():
-                result[key] = self.unknown_names[cls].pop(randrange(0, len(self.unknown_names[cls])))
+            keys = cls.__subclasses__()
+            result.update(zip(keys, rng.sample(self.unknown_names[cls], len(keys))))
         return result
             
\ No newline at end of file
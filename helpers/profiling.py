@@ -0,0 +1,97 @@
+"""Instrumentation for the command pipeline.
+
+`CommandStats` collects per-command timing when enabled on a Game
+with `Game.enable_stats`. When stats are disabled, the game runs its
+normal code path and pays nothing for this module.
+
+`import_times` reports what a cold import of some modules costs.
+"""
+import subprocess
+import sys
+from collections import Counter, defaultdict, deque, namedtuple
+from math import ceil
+from typing import Dict, List
+
+class CommandStats():
+    """Call count, latency and follow-ups of each Command subclass.
+
+    The latency of a command covers its own `execute` only: follow-up
+    commands are timed separately, under their own type."""
+
+    SAMPLES = 1000
+    """Number of latencies kept per command type to estimate percentiles."""
+
+    def __init__(self):
+        self.calls = Counter()
+        """Number of executions, by command type."""
+        self.total = defaultdict(float)
+        """Total seconds spent executing, by command type."""
+        self.followups = Counter()
+        """Number of follow-up commands spawned, by command type."""
+        self._samples = defaultdict(lambda: deque(maxlen=self.SAMPLES))
+
+    def record(self, cmd_type: type, seconds: float, followups: int) -> None:
+        """Records an execution of a command of type `cmd_type`."""
+        self.calls[cmd_type] += 1
+        self.total[cmd_type] += seconds
+        self.followups[cmd_type] += followups
+        self._samples[cmd_type].append(seconds)
+
+    def percentile(self, cmd_type: type, percent: float) -> float:
+        """Returns the given percentile of the recent latencies of `cmd_type`."""
+        samples = sorted(self._samples[cmd_type])
+        if not samples:
+            return 0.0
+        return samples[max(0, ceil(percent / 100 * len(samples)) - 1)]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Returns the statistics of each command type, by type name."""
+        return {
+            cmd_type.__name__: {
+                "calls": calls,
+                "total": self.total[cmd_type],
+                "mean": self.total[cmd_type] / calls,
+                "p99": self.percentile(cmd_type, 99),
+                "followups": self.followups[cmd_type],
+            }
+            for cmd_type, calls in self.calls.items()
+        }
+
+    def lines(self) -> List[str]:
+        """Returns a human-readable report, slowest commands first."""
+        rows = sorted(self.summary().items(), key=lambda row: -row[1]["total"])
+        return [
+            "{:<18}{:>7} calls {:>9.1f}us avg {:>9.1f}us p99 {:>5.2f} follow-ups".format(
+                name, row["calls"], row["mean"] * 1e6, row["p99"] * 1e6, row["followups"] / row["calls"])
+            for name, row in rows
+        ]
+
+class ImportTime(namedtuple("ImportTime", "module own total depth")):
+    """Time spent importing a module, in seconds: by itself, and with the
+    modules it imported first. `depth` is its level in the import tree."""
+    __slots__ = ()
+
+def import_times(statement: str) -> List[ImportTime]:
+    """Runs `statement` (e.g. "import models.game") in a fresh interpreter
+    with `-X importtime`, and returns the imports it made, in order."""
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    result = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, total, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        result.append(ImportTime(name.strip(), int(own) / 1e6, int(total) / 1e6, depth))
+    return result
+
+def import_report(statement: str, limit: int = 20) -> List[str]:
+    """Returns a human-readable report of the slowest imports made by
+    `statement`, with the total import time on the first line."""
+    times = import_times(statement)
+    total = sum(entry.total for entry in times if entry.depth == 0)
+    lines = ["{:.1f}ms importing for {!r}".format(total * 1e3, statement)]
+    for entry in sorted(times, key=lambda entry: -entry.total)[:limit]:
+        lines.append("{:>9.1f}ms {:>9.1f}ms self  {}{}".format(
+            entry.total * 1e3, entry.own * 1e3, "  " * entry.depth, entry.module))
+    return lines
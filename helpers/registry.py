@@ -0,0 +1,21 @@
+"""Registries of classes by stable id.
+
+Save files and command logs refer to classes (commands, item types) by
+an integer id. Each class declares its id, so that adding, removing or
+reordering classes doesn't change what existing files mean.
+"""
+from typing import Dict, Optional
+
+def register(registry: Dict[int, type], cls: type, registry_id: Optional[int]) -> int:
+    """Adds `cls` to `registry` under `registry_id`, and returns the id.
+
+    Raises TypeError if `registry_id` is missing, and ValueError if
+    another class already uses it."""
+    if registry_id is None:
+        raise TypeError("{} must declare a registry_id".format(cls.__name__))
+    other = registry.get(registry_id)
+    if other is not None:
+        raise ValueError("registry_id {} of {} is already used by {}".format(
+            registry_id, cls.__name__, other.__name__))
+    registry[registry_id] = cls
+    return registry_id
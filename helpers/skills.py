@@ -1,46 +1,204 @@
 from collections import OrderedDict
-from typing import Optional, Dict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
-class Inventory(OrderedDict):
+class InventoryView(OrderedDict):
+    """Read-only Slot->Item mapping over (part of) an Inventory.
+
+    Views are cached by their inventory, and dropped as soon as it
+    changes: don't modify them, and don't keep them around."""
+
+    def __init__(self, inventory: 'Inventory', slots: List[str]):
+        super().__init__((slot, inventory[slot]) for slot in slots)
+        self._inventory = inventory
+        self._descriptions = {}
+
+    def get_view(self, describer: Callable[['Item'], str]) -> Dict[str, 'Item']:
+        """Returns a Description->Item mapping.
+
+        The result is cached until the inventory changes, or the version
+        of the describer's factory (see `DescriptionFactory.version`) does."""
+        key = describer, getattr(getattr(describer, "__self__", None), "version", None)
+        try:
+            return self._descriptions[key]
+        except KeyError:
+            pass
+        view = {self._inventory.pretty_print(slot, describer): self[slot] for slot in self}
+        self._descriptions[key] = view
+        return view
+
+class Inventory():
+    """Items carried by a creature, by slot letter.
+
+    Identical items (see `stack_key`) are stacked in the same slot.
+    Indexing a slot returns the item on top of its stack.
+
+    Slots are allocated from a free-slot bitmap, and an item->slot
+    index and per-category indexes are updated on every change, so
+    adding and removing items doesn't depend on the inventory's size."""
     _letters = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    _numbers = {letter: i for i, letter in enumerate(_letters)}
 
-    def __init__(self, *args, **kwargs):
-        self.update(*args, **kwargs)        
+    def __init__(self, items: Optional[Dict[str, 'Item']] = None):
+        self._stacks = {}
+        """Slot->list of items, the top of the stack first."""
+        self._free = (1 << len(self._letters)) - 1
+        """Bitmap of the free slots: bit i is set when slot `_letters[i]` is free."""
+        self._slots = {}
+        """id(item)->slot index."""
+        self._keys = {}
+        """Stack key->slot index."""
+        self._slot_keys = {}
+        """Slot->stack key its items were added with."""
+        self._categories = {}
+        """Category->set of slots index."""
+        self._views = {}
+        """Cached views, by category (None for the whole inventory)."""
+        self._sorted = None
+        if items:
+            for slot, item in items.items():
+                self.add(item, slot)
+
+    @staticmethod
+    def stack_key(item: 'Item') -> tuple:
+        """Items with the same key are stacked together.
+
+        The key depends on fields that can change (e.g. when the
+        beatitude of an item gets known): call `restack` afterwards."""
+        return type(item), item.beatitude, item.beatitude_known
+
+    def __len__(self) -> int:
+        """Number of used slots."""
+        return len(self._stacks)
+
+    def __iter__(self) -> Iterator[str]:
+        """Yields the used slots, in alphabetical order."""
+        return iter(sorted(self._stacks, key=self._numbers.__getitem__))
+
+    def __contains__(self, slot: str) -> bool:
+        return slot in self._stacks
+
+    def __getitem__(self, slot: str) -> 'Item':
+        return self._stacks[slot][0]
+
+    def __repr__(self):
+        return "Inventory({!r})".format({slot: self.stack(slot) for slot in self})
+
+    def keys(self) -> Iterator[str]:
+        return iter(self)
+
+    def values(self) -> Iterator['Item']:
+        return (self[slot] for slot in self)
+
+    def items(self) -> Iterator[Tuple[str, 'Item']]:
+        return ((slot, self[slot]) for slot in self)
+
+    def stack(self, slot: str) -> Tuple['Item', ...]:
+        """Returns all the items in `slot`."""
+        return tuple(self._stacks[slot])
+
+    def count(self, slot: str) -> int:
+        """Returns the number of items in `slot`."""
+        return len(self._stacks[slot])
+
+    def slot(self, item: 'Item') -> Optional[str]:
+        """Returns the slot that holds `item`, or None."""
+        return self._slots.get(id(item))
+
+    def add(self, item: 'Item', slot: Optional[str] = None) -> Optional[str]:
+        """Adds `item` and returns its slot, or None if the inventory is full.
+
+        :param slot: put the item in this slot instead of choosing one.
+            The slot must be free or hold a stack of identical items."""
+        key = self.stack_key(item)
+        if slot is None:
+            slot = self._keys.get(key) or self.next_empty()
+            if slot is None:
+                return None
+        elif slot in self._stacks and self._keys.get(key) != slot:
+            raise ValueError("Slot {} holds different items".format(slot))
+        stack = self._stacks.get(slot)
+        if stack is None:
+            stack = self._stacks[slot] = []
+            self._free &= ~(1 << self._numbers[slot])
+            self._keys[key] = slot
+            self._slot_keys[slot] = key
+            self._categories.setdefault(item.category, set()).add(slot)
+        stack.insert(0, item)
+        self._slots[id(item)] = slot
+        self._changed()
+        return slot
 
-    def add(self, item: 'Item') -> Optional[str]:
-        s = self.next_empty()
-        if s:
-            self[s] = item
-            return s
-        else:
-            return None
-    
     def remove(self, item: 'Item') -> None:
-        keys = [k for k in self.keys() if self[k] is item]
-        for key in keys:
-            del self[key]
-
-    def next_empty(self):
-        for slot in self._letters:
-            if slot not in self:
-                return slot
-        return None
-    
-    def sorted(self) -> Dict[type, 'Inventory']:
-        categories = set(item.category for item in self.values())
-        out = {}
-        for cat in categories:
-            out[cat] = Inventory({key: value for key, value in self.items() if value.category == cat})
-        return out
-
-    def filter(self, category: 'Item') -> 'Inventory':
-        if category:
-            return Inventory({key: value for key, value in self.items() if value.category == category})
-        else:
-            return self.copy()
-
-    def get_view(self, describer) -> Dict[str, 'Item']:
-        return {self.pretty_print(key, describer): self[key] for key in self}
-
-    def pretty_print(self, key, describer) -> str:
-        return "{} - {}".format(key, describer(self[key]))
\ No newline at end of file
+        """Removes `item`, if it is in the inventory."""
+        slot = self._slots.pop(id(item), None)
+        if slot is None:
+            return
+        stack = self._stacks[slot]
+        stack.remove(next(i for i in stack if i is item))
+        if not stack:
+            del self._stacks[slot]
+            self._free |= 1 << self._numbers[slot]
+            key = self._slot_keys.pop(slot)
+            if self._keys.get(key) == slot:
+                del self._keys[key]
+            slots = self._categories[item.category]
+            slots.discard(slot)
+            if not slots:
+                del self._categories[item.category]
+        self._changed()
+
+    def restack(self, item: 'Item') -> Optional[str]:
+        """Moves `item` to the stack it belongs to after its stack key
+        changed, and returns its slot (None if it isn't in the inventory).
+
+        An item that is alone in its slot keeps the slot, unless it
+        joins another stack."""
+        slot = self._slots.get(id(item))
+        if slot is None:
+            return None
+        old, key = self._slot_keys[slot], self.stack_key(item)
+        if key == old:
+            return slot
+        if len(self._stacks[slot]) == 1 and key not in self._keys:
+            if self._keys.get(old) == slot:
+                del self._keys[old]
+            self._keys[key] = slot
+            self._slot_keys[slot] = key
+            self._changed()
+            return slot
+        self.remove(item)
+        return self.add(item)
+
+    def next_empty(self) -> Optional[str]:
+        """Returns the first free slot, or None if the inventory is full."""
+        if not self._free:
+            return None
+        return self._letters[(self._free & -self._free).bit_length() - 1]
+
+    def _changed(self) -> None:
+        self._views.clear()
+        self._sorted = None
+
+    def sorted(self) -> Dict[type, InventoryView]:
+        """Returns a view of the inventory per item category. The result is cached."""
+        if self._sorted is None:
+            self._sorted = {cat: self.filter(cat) for cat in self._categories}
+        return self._sorted
+
+    def filter(self, category: Optional[type]) -> InventoryView:
+        """Returns a view of the items in `category`, or of all items. The result is cached."""
+        view = self._views.get(category)
+        if view is None:
+            slots = self._categories.get(category, ()) if category else self._stacks
+            view = self._views[category] = InventoryView(self, sorted(slots, key=self._numbers.__getitem__))
+        return view
+
+    def get_view(self, describer: Callable[['Item'], str]) -> Dict[str, 'Item']:
+        """Returns a Description->Item mapping of the whole inventory."""
+        return self.filter(None).get_view(describer)
+
+    def pretty_print(self, key: str, describer: Callable[['Item'], str]) -> str:
+        count = len(self._stacks[key])
+        if count > 1:
+            return "{} - {} (x{})".format(key, describer(self[key]), count)
+        return "{} - {}".format(key, describer(self[key]))
@@ -1,28 +1,103 @@
 """Validation decorator
 
 This module contains a decorator that will validate input to functions/methods.
+
+Schemas are compiled to a specialized wrapper once, when the function is
+decorated, so checking arguments costs a few comparisons per call.
+Validation is on in normal runs and off under `python -O`, where the
+decorator returns functions unwrapped; the ROGUELIKE_VALIDATE
+environment variable ("1" or "0") overrides this.
 """
 
+import os
 from functools import wraps
-from typing import Dict
+from typing import Callable, Dict, Optional
+
+from helpers.exceptions import ValidationError
+
+ENABLED = os.environ.get("ROGUELIKE_VALIDATE", "1" if __debug__ else "0") != "0"
+"""Whether `validate` checks arguments. Read when functions are decorated."""
+
+_TYPES = {
+    'integer': (int,),
+    'float': (float,),
+    'number': (int, float),
+    'string': (str,),
+    'boolean': (bool,),
+    'list': (list,),
+    'dict': (dict,),
+}
+"""Python types of the Cerberus type names that `_compile` handles."""
 
-from cerberus import Validator
-from cerberus.errors import ValidationError
+_RULES = {'type', 'min', 'max', 'allowed', 'nullable'}
+"""Cerberus rules that `_compile` handles."""
 
-def validate(schema: Dict):
-    """ Validation decorator. 
-    :param schema: a Cerberus-compatible schema dictionary
+def validate(schema: Dict, enabled: Optional[bool] = None):
+    """ Validation decorator.
+    :param schema: a Cerberus-compatible schema dictionary, keyed by
+        the index of positional arguments
+    :param enabled: overrides `ENABLED`
     """
-    validator = Validator(schema=schema, allow_unknown=True)
+    if enabled is None:
+        enabled = ENABLED
     def _decorator(func):
-        @wraps(func)
-        def _wrapper(*args):
-            document = dict(enumerate(args))
-            if not validator(document):
-                raise ValidationError(validator.errors)
-            if isinstance(func, staticmethod):
-                return func.__func__(*args)
-            else:
-                return func(*args)
-        return _wrapper
+        if not enabled:
+            return func
+        if isinstance(func, staticmethod):
+            return staticmethod(_decorator(func.__func__))
+        if all(set(rules) <= _RULES and rules.get('type', 'integer') in _TYPES for rules in schema.values()):
+            wrapper = _compile(schema, func)
+        else:
+            wrapper = _cerberus(schema, func)
+        return wraps(func)(wrapper)
     return _decorator
+
+def _compile(schema: Dict, func: Callable) -> Callable:
+    """Generates a wrapper that checks the arguments of `func` against `schema`."""
+    namespace = {'func': func, 'ValidationError': ValidationError, 'isinstance': isinstance, 'len': len}
+    lines = ["def _wrapper(*args):", "    errors = None", "    n = len(args)"]
+    def fail(indent: str, index: int, message: str) -> None:
+        # `message` is an expression, so that it can show the value
+        lines.append(indent + "errors = errors or {{}}; errors.setdefault({}, []).append({})".format(index, message))
+    for index, rules in sorted(schema.items()):
+        indent = " " * 8
+        lines.append("    if n > {}:".format(index))
+        lines.append(indent + "v = args[{}]".format(index))
+        lines.append(indent + "if v is None:")
+        if rules.get('nullable', False):
+            lines.append(indent + "    pass")
+        else:
+            fail(indent + "    ", index, repr("null value not allowed"))
+        if 'type' in rules:
+            namespace['types{}'.format(index)] = _TYPES[rules['type']]
+            lines.append(indent + "elif not isinstance(v, types{}):".format(index))
+            fail(indent + "    ", index, repr("must be of {} type".format(rules['type'])))
+        lines.append(indent + "else:")
+        lines.append(indent + "    pass")
+        indent += "    "
+        if 'allowed' in rules:
+            namespace['allowed{}'.format(index)] = frozenset(rules['allowed'])
+            lines.append(indent + "if v not in allowed{}:".format(index))
+            fail(indent + "    ", index, "'unallowed value {}'.format(v)")
+        if 'min' in rules:
+            lines.append(indent + "if v < {!r}:".format(rules['min']))
+            fail(indent + "    ", index, repr("min value is {}".format(rules['min'])))
+        if 'max' in rules:
+            lines.append(indent + "if v > {!r}:".format(rules['max']))
+            fail(indent + "    ", index, repr("max value is {}".format(rules['max'])))
+    lines.append("    if errors:")
+    lines.append("        raise ValidationError(errors)")
+    lines.append("    return func(*args)")
+    exec("\n".join(lines), namespace)
+    return namespace['_wrapper']
+
+def _cerberus(schema: Dict, func: Callable) -> Callable:
+    """Returns a wrapper that checks the arguments of `func` with Cerberus,
+    for schemas that use rules `_compile` doesn't handle."""
+    from cerberus import Validator
+    validator = Validator(schema=schema, allow_unknown=True)
+    def _wrapper(*args):
+        if not validator(dict(enumerate(args))):
+            raise ValidationError(validator.errors)
+        return func(*args)
+    return _wrapper
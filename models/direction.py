@@ -13,8 +13,11 @@ class Direction(Enum):
 
     @staticmethod
     def basic() -> Iterable['Direction']:
-        return (d for d in Direction if not all(d.value))
+        return _BASIC
 
     @staticmethod
     def diagonal() -> Iterable['Direction']:
-        return (d for d in Direction if all(d.value))
+        return _DIAGONAL
+
+_BASIC = tuple(d for d in Direction if not all(d.value))
+_DIAGONAL = tuple(d for d in Direction if all(d.value))
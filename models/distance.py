@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Distance maps.
+
+A distance map holds, for every walkable square of a level, the number
+of moves to the nearest of a set of goals (e.g. the player). Creatures
+that chase a goal all share the same map, and find their next step by
+looking at their neighbors, in constant time.
+
+Maps are built with a breadth-first search over flat, row-major arrays.
+When a map's only goal moves to a neighboring square, the map is
+updated instead of rebuilt: every distance grows by at most one, which
+is applied lazily through a bias, and only the squares that got closer
+are visited.
+"""
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from models.position import Position, at, neighbor_offsets, offset_of
+
+_INF = 1 << 60
+"""Stored distance of the squares no goal can be reached from."""
+
+class DistanceMaps():
+    """The distance maps of a level, by name.
+
+    Maps are dropped whenever a square is added to or removed from
+    the level."""
+
+    def __init__(self, level: 'Level'):
+        self.level = level
+        self._maps = {}     # type: Dict[str, DistanceMap]
+        self._version = None
+        self.neighbors = None
+        """Walkable neighbors of each walkable cell, by row-major offset (None elsewhere)."""
+
+    def _refresh(self) -> None:
+        """Rebuilds the neighbor table if the level changed."""
+        if self._version == self.level.version:
+            return
+        walkable = [entry is not None and entry[1].is_walkable for entry in self.level._grid]
+        neighbors = [None] * len(walkable)
+        for offset, cells in enumerate(neighbor_offsets(True)):
+            if walkable[offset]:
+                neighbors[offset] = tuple(n for n in cells if walkable[n])
+        self.neighbors = neighbors
+        self._maps.clear()
+        self._version = self.level.version
+
+    def get(self, name: str, goals: Iterable[Position]) -> 'DistanceMap':
+        """Returns the map called `name`, up to date for `goals`.
+
+        Call this every turn with the current goals: the map is only
+        recomputed when they changed, and only updated if its single
+        goal moved by one square."""
+        self._refresh()
+        goals = frozenset(goals)
+        dmap = self._maps.get(name)
+        if dmap is None:
+            dmap = self._maps[name] = DistanceMap(self, goals)
+        elif dmap.goals != goals:
+            if len(goals) == 1 and len(dmap.goals) == 1:
+                (old,), (new,) = dmap.goals, goals
+                if max(abs(old.col - new.col), abs(old.row - new.row)) == 1:
+                    dmap.move_goal(new)
+                    return dmap
+            dmap.reset(goals)
+        return dmap
+
+class DistanceMap():
+    """Distances from each square of a level to the nearest goal.
+
+    Use `DistanceMaps.get` rather than building maps directly."""
+
+    def __init__(self, maps: DistanceMaps, goals: FrozenSet[Position]):
+        self._maps = maps
+        self.reset(goals)
+
+    def reset(self, goals: FrozenSet[Position]) -> None:
+        """Recomputes the whole map for `goals`."""
+        self.goals = goals
+        self._bias = 0
+        """Added to every stored distance."""
+        neighbors = self._maps.neighbors
+        self._dist = dist = [_INF] * len(neighbors)
+        frontier = [o for o in map(offset_of, goals) if o is not None and neighbors[o] is not None]
+        for offset in frontier:
+            dist[offset] = 0
+        self._relax(frontier, 0)
+
+    def move_goal(self, goal: Position) -> None:
+        """Updates the map of a single goal that moved to a neighboring square."""
+        self.goals = frozenset((goal,))
+        self._bias += 1
+        offset = offset_of(goal)
+        if offset is None or self._maps.neighbors[offset] is None:
+            return
+        if self._dist[offset] > -self._bias:
+            self._dist[offset] = -self._bias
+            self._relax([offset], -self._bias)
+
+    def _relax(self, frontier: List[int], start: int) -> None:
+        """Lowers distances, breadth-first, from `frontier` (whose stored distance is `start`)."""
+        dist, neighbors = self._dist, self._maps.neighbors
+        target = start
+        while frontier:
+            target += 1
+            next_frontier = []
+            for offset in frontier:
+                for n in neighbors[offset]:
+                    if dist[n] > target:
+                        dist[n] = target
+                        next_frontier.append(n)
+            frontier = next_frontier
+
+    def distance(self, pos: Position) -> Optional[int]:
+        """Returns the number of moves from `pos` to the nearest goal, or
+        None if `pos` is not walkable or no goal can be reached from it."""
+        offset = offset_of(pos)
+        if offset is None or self._maps.neighbors[offset] is None:
+            return None
+        d = self._dist[offset] + self._bias
+        return d if d < _INF else None
+
+    def step(self, pos: Position) -> Optional[Position]:
+        """Returns the neighbor of `pos` that is closest to a goal, or None
+        if no neighbor is closer than `pos` itself."""
+        offset = offset_of(pos)
+        neighbors = self._maps.neighbors[offset] if offset is not None else None
+        if neighbors is None:
+            return None
+        dist = self._dist
+        best, best_dist = None, dist[offset]
+        for n in neighbors:
+            if dist[n] < best_dist:
+                best, best_dist = n, dist[n]
+        if best is None:
+            return None
+        return at(best)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Game events.
+
+Commands and the game publish events on the game's EventBus as they
+change the game's state. The bus holds them until the end of the turn,
+then coalesces them (e.g. two moves of the same creature become one)
+and dispatches them to the listeners of each event type, followed by
+a single TurnEnded event that carries the whole batch.
+"""
+from collections import OrderedDict, namedtuple
+from typing import Callable, List, Optional, Sequence
+
+from mediator import Event, Mediator
+
+class GameEvent(Event):
+    """Base class for game events."""
+
+    @classmethod
+    def coalesce(cls, events: List['GameEvent']) -> List['GameEvent']:
+        """Merges the events of one turn. By default, they are all kept."""
+        return events
+
+class Moved(GameEvent, namedtuple("Moved", "creature old new")):
+    """A creature moved within its level, from `old` to `new`."""
+    __slots__ = ()
+
+    @classmethod
+    def coalesce(cls, events):
+        moves = OrderedDict()
+        for event in events:
+            first = moves.get(id(event.creature), event)
+            moves[id(event.creature)] = cls(event.creature, first.old, event.new)
+        return list(moves.values())
+
+class LightsChanged(GameEvent, namedtuple("LightsChanged", "level positions")):
+    """The lighting or visibility of some squares of a level changed."""
+    __slots__ = ()
+
+    @classmethod
+    def coalesce(cls, events):
+        levels = OrderedDict()
+        for event in events:
+            levels.setdefault(id(event.level), (event.level, set()))[1].update(event.positions)
+        return [cls(level, frozenset(positions)) for level, positions in levels.values()]
+
+class HealthChanged(GameEvent, namedtuple("HealthChanged", "creature old new")):
+    """A creature's hit points went from `old` to `new`."""
+    __slots__ = ()
+
+    @classmethod
+    def coalesce(cls, events):
+        changes = OrderedDict()
+        for event in events:
+            first = changes.get(id(event.creature), event)
+            changes[id(event.creature)] = cls(event.creature, first.old, event.new)
+        return [event for event in changes.values() if event.old != event.new]
+
+class ItemPickedUp(GameEvent, namedtuple("ItemPickedUp", "creature item slot")):
+    """A creature put an item from the floor in its inventory."""
+    __slots__ = ()
+
+class ItemDestroyed(GameEvent, namedtuple("ItemDestroyed", "item")):
+    """An item was removed from the game (e.g. it was quaffed)."""
+    __slots__ = ()
+
+class ItemIdentified(GameEvent, namedtuple("ItemIdentified", "item_type")):
+    """The player learned the true name of an item type."""
+    __slots__ = ()
+
+class LevelEntered(GameEvent, namedtuple("LevelEntered", "creature level depth")):
+    """A creature arrived on another level."""
+    __slots__ = ()
+
+class TurnEnded(GameEvent, namedtuple("TurnEnded", "turn events")):
+    """Sent after the other events of a turn, with all of them, in order."""
+    __slots__ = ()
+
+class EventBus(Mediator):
+    """Batches the events of each turn and dispatches them to listeners.
+
+    Events are only collected if someone listens to their type or to
+    TurnEnded, so publishing costs next to nothing otherwise."""
+
+    def __init__(self):
+        super().__init__()
+        self._pending = []
+
+    def subscribe(self, event_type: type, listener: Callable[[GameEvent], None],
+                  priority: Optional[int] = None) -> None:
+        """Calls `listener` with every `event_type` event, at the end of each turn.
+
+        Listeners with lower priority are called first."""
+        self.add_listener(event_type, listener, priority)
+
+    def unsubscribe(self, event_type: type, listener: Callable[[GameEvent], None]) -> None:
+        """Stops calling `listener` with `event_type` events.
+
+        Listeners are compared for equality, so that bound methods can be
+        unsubscribed. Types left without listeners are dropped, so that
+        `publish` stops collecting their events."""
+        name = event_type.get_event_name()
+        listeners = self._listeners.get(name, {})
+        for priority, other in list(listeners.items()):
+            if other == listener:
+                del listeners[priority]
+                break
+        if not listeners:
+            self._listeners.pop(name, None)
+
+    def publish(self, event: GameEvent) -> None:
+        """Queues `event` until the end of the turn."""
+        listeners = self._listeners
+        if listeners and (event.get_event_name() in listeners or "TurnEnded" in listeners):
+            self._pending.append(event)
+
+    def flush(self, turn: int) -> Sequence[GameEvent]:
+        """Coalesces and dispatches the events of the turn that just ended.
+
+        Events are dispatched grouped by type, in order of first
+        appearance. Returns the dispatched events."""
+        if not self._pending:
+            return ()
+        pending, self._pending = self._pending, []
+        by_type = OrderedDict()
+        for event in pending:
+            by_type.setdefault(type(event), []).append(event)
+        batch = []
+        for event_type, events in by_type.items():
+            batch.extend(event_type.coalesce(events) if len(events) > 1 else events)
+        for event in batch:
+            self.dispatch(event)
+        batch = tuple(batch)
+        if "TurnEnded" in self._listeners:
+            self.dispatch(TurnEnded(turn, batch))
+        return batch
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Field of view.
+
+Computes the set of positions visible from a given position, using
+recursive shadowcasting on the level's opacity grid: walkable squares
+are transparent, walls and solid rock are opaque.
+
+.. seealso:: http://www.roguebasin.com/index.php?title=FOV_using_recursive_shadowcasting
+"""
+from collections import OrderedDict
+from typing import FrozenSet, Set
+
+from models.position import Position, at
+
+# Multipliers that map each of the 8 octants onto the first one
+_OCTANTS = (
+    (1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+    (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1)
+)
+
+class FieldOfView():
+    """Field of view engine for a level.
+
+    Results are memoized per (position, radius) in an LRU cache.
+    The cache and the opacity grid are dropped whenever the level's
+    map changes."""
+
+    CACHE_SIZE = 256
+    """Maximum number of cached results."""
+
+    def __init__(self, level: 'Level'):
+        self.level = level
+        self._cache = OrderedDict()
+        self._version = None
+        self._transparent = None
+        """Row-major bytearray, 1 where light goes through."""
+
+    def _refresh(self) -> None:
+        """Rebuilds the opacity grid if the level changed."""
+        if self._version == self.level.version:
+            return
+        self._cache.clear()
+        self._transparent = bytearray(
+            entry is not None and entry[1].is_walkable for entry in self.level._grid
+        )
+        self._version = self.level.version
+
+    def visible(self, pos: Position, radius: int) -> FrozenSet[Position]:
+        """Returns the positions visible from `pos` within `radius`."""
+        self._refresh()
+        key = (pos, radius)
+        try:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        except KeyError:
+            pass
+        cells = {pos.offset}
+        for octant in _OCTANTS:
+            self._cast(pos.col, pos.row, 1, 1.0, 0.0, radius, octant, cells)
+        result = frozenset(map(at, cells))
+        self._cache[key] = result
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return result
+
+    def _cast(self, col: int, row: int, start_row: int, start: float, end: float,
+              radius: int, octant: tuple, cells: Set[int]) -> None:
+        """Scans one octant, recursing past each opaque run."""
+        if start < end:
+            return
+        width, height = Position.SCREEN_W, Position.SCREEN_H
+        transparent = self._transparent
+        xx, xy, yx, yy = octant
+        radius_sq = radius * radius
+        new_start = start
+        for j in range(start_row, radius + 1):
+            dx, dy = -j - 1, -j
+            blocked = False
+            while dx <= 0:
+                dx += 1
+                l_slope, r_slope = (dx - 0.5) / (dy + 0.5), (dx + 0.5) / (dy - 0.5)
+                if start < r_slope:
+                    continue
+                elif end > l_slope:
+                    break
+                x, y = col + dx * xx + dy * xy, row + dx * yx + dy * yy
+                inside = 0 <= x < width and 0 <= y < height
+                if inside and dx * dx + dy * dy <= radius_sq:
+                    cells.add(y * width + x)
+                opaque = not inside or not transparent[y * width + x]
+                if blocked:
+                    if opaque:
+                        new_start = r_slope
+                    else:
+                        blocked = False
+                        start = new_start
+                elif opaque and j < radius:
+                    blocked = True
+                    self._cast(col, row, j + 1, start, l_slope, radius, octant, cells)
+                    new_start = r_slope
+            if blocked:
+                break
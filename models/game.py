@@ -1,16 +1,24 @@
-from collections import deque, namedtuple
-from typing import List
-from random import randrange
-
-from mediator import Mediator
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter
+from typing import Iterable, Iterator, List, Dict, Optional, Union
 
 from helpers.i18n import EnglishDescriptionFactory
 from models.items import Item, HealingPotion, HealingScroll
+from models.events import EventBus, ItemDestroyed, LevelEntered
 from models.level import Level
 from models.player import Player
+from models.scheduler import Scheduler
 from models.direction import Direction
+from rnd.dice import Rng
 from helpers.commands import *
 from helpers.exceptions import EmptyInventoryException
+from helpers.profiling import CommandStats
 
 class Popup(namedtuple("Popup", "title body")):
     pass
@@ -32,22 +40,265 @@ class InventoryQuery():
         if item:
             self.game.add_command(self.callback(item))
         else:
-            self.game.add_command(AddMessage("Never mind."))
+            self.game.add_command(NEVER_MIND[0])
+
+def generate_level(seed: int) -> Level:
+    """Builds the level for `seed`.
+
+    This runs in worker processes, so it must stay a module-level function."""
+    return Level(rng=Rng(seed))
+
+class LevelSupply():
+    """Generates upcoming dungeon levels ahead of time.
+
+    Levels are built in worker processes and handed over pickled, so
+    they carry no references to the game. Each depth has its own seed,
+    derived from the supply's seed: the same seed always yields the
+    same dungeon, no matter which process built which level."""
+
+    def __init__(self, seed: int, ahead: int = 2, workers: int = 0):
+        """
+        :param seed: base seed for the whole dungeon.
+        :param ahead: number of levels to prepare past the last one requested.
+        :param workers: number of worker processes. With 0, levels are built
+            synchronously when requested. Call `close` to stop the workers."""
+        self.rng = Rng(seed)
+        self.ahead = ahead
+        self._pending = {}  # type: Dict[int, Future]
+        self._executor = ProcessPoolExecutor(workers) if workers else None
+
+    def seed_for(self, depth: int) -> int:
+        """Returns the seed for the level at `depth`."""
+        return self.rng.split(depth).initial_seed
+
+    def get(self, depth: int) -> Level:
+        """Returns the level at `depth`, waiting for it if it's still being built.
+
+        The caller becomes the only owner of the level."""
+        future = self._pending.pop(depth, None)
+        level = None
+        if future is not None:
+            try:
+                level = future.result()
+            except BrokenProcessPool:
+                self.close()
+        if level is None:
+            level = generate_level(self.seed_for(depth))
+        self._prefetch(depth + 1)
+        return level
+
+    def _prefetch(self, depth: int) -> None:
+        """Starts building levels from `depth` onwards."""
+        if self._executor is None:
+            return
+        for next_depth in range(depth, depth + self.ahead):
+            if next_depth not in self._pending:
+                self._pending[next_depth] = self._executor.submit(generate_level, self.seed_for(next_depth))
+
+    def close(self) -> None:
+        """Stops the worker processes. Further levels are built synchronously."""
+        if self._executor is not None:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+class LevelList():
+    """The levels of a dungeon, by depth.
+
+    An entry can be an encoded level (see `models.savegame.encode_level`)
+    instead of a Level: it's decoded the first time it's accessed.
+
+    Only the `max_resident` most recently accessed levels are kept in
+    memory. Older ones are encoded to a private directory inside
+    `cache_dir`, and decoded again when accessed. The `pinned` level
+    (the player's) and the level being accessed are never evicted, so
+    up to `max_resident` + 1 levels can be in memory."""
+    MAX_RESIDENT = 4
+    """Default for `max_resident`."""
+
+    def __init__(self, levels: Iterable[Union[Level, bytes]] = (), max_resident: Optional[int] = None,
+                 cache_dir: Optional[str] = None):
+        """
+        :param max_resident: maximum number of levels in memory. With 0,
+            levels are never evicted.
+        :param cache_dir: where to store evicted levels. Defaults to the
+            system's temporary directory."""
+        self._levels = list(levels)
+        self.max_resident = self.MAX_RESIDENT if max_resident is None else max_resident
+        self.cache_dir = cache_dir
+        self._dir = None
+        self._recent = OrderedDict()
+        """Depths of the levels in memory, least recently accessed first."""
+        self._evicted = {}
+        """Paths of the evicted levels, by depth."""
+        self.pinned = None
+        """Depth of the level that must stay in memory, if any."""
+        self.evictions = 0
+        """Number of levels written to the cache."""
+        self.reloads = 0
+        """Number of levels read back from the cache."""
+
+    def __len__(self) -> int:
+        return len(self._levels)
+
+    def __getitem__(self, depth: int) -> Level:
+        depth = range(len(self._levels))[depth]
+        level = self._levels[depth]
+        if not isinstance(level, Level):
+            level = self._levels[depth] = self._decode(depth)
+        self._recent[depth] = None
+        self._recent.move_to_end(depth)
+        if self.max_resident:
+            while len(self._recent) > self.max_resident:
+                victim = next((d for d in self._recent if d != depth and d != self.pinned), None)
+                if victim is None:
+                    break
+                self._evict(victim)
+        return level
+
+    def __iter__(self) -> Iterator[Level]:
+        for depth in range(len(self._levels)):
+            yield self[depth]
+
+    def append(self, level: Union[Level, bytes]) -> None:
+        self._levels.append(level)
+
+    def index(self, level: Level) -> int:
+        """Returns the depth of `level`, which must be in memory."""
+        for depth, entry in enumerate(self._levels):
+            if entry is level:
+                return depth
+        raise ValueError("Level not in list")
+
+    def is_loaded(self, depth: int) -> bool:
+        return isinstance(self._levels[depth], Level)
+
+    def encoded(self, depth: int) -> bytes:
+        """Returns the encoded level at `depth`, without loading it."""
+        from models.savegame import encode_level   # models.savegame imports this module
+        entry = self._levels[depth]
+        if isinstance(entry, Level):
+            return encode_level(entry)
+        elif depth in self._evicted:
+            with open(self._evicted[depth], "rb") as f:
+                return f.read()
+        return bytes(entry)
+
+    def _decode(self, depth: int) -> Level:
+        from models.savegame import decode_level
+        path = self._evicted.pop(depth, None)
+        if path is None:
+            return decode_level(self._levels[depth])
+        with open(path, "rb") as f:
+            level = decode_level(f.read())
+        os.remove(path)
+        self.reloads += 1
+        return level
+
+    def _evict(self, depth: int) -> None:
+        """Writes the level at `depth` to the cache and drops it from memory."""
+        from models.savegame import encode_level
+        del self._recent[depth]
+        if self._dir is None:
+            self._dir = tempfile.mkdtemp(prefix="levels-", dir=self.cache_dir)
+            weakref.finalize(self, shutil.rmtree, self._dir, True)
+        path = os.path.join(self._dir, "{}.lvl".format(depth))
+        with open(path, "wb") as f:
+            f.write(encode_level(self._levels[depth]))
+        self._levels[depth] = None
+        self._evicted[depth] = path
+        self.evictions += 1
 
 class Game():
     """The game.
     This is essentially a facade to the whole models package."""
 
-    def __init__(self, description_factory):
-        self.descriptions = description_factory
-        self.levels = [Level()]
-        self.player = Player.create(self.levels[0], self.levels[0].get_random_walkable())
+    def __init__(self, description_factory, seed: Optional[int] = None, level_supply: Optional[LevelSupply] = None,
+                 levels: Optional[LevelList] = None, workers: int = 0):
+        """
+        :param seed: dungeon seed. If None, a random one is picked.
+        :param level_supply: source of new levels. Defaults to a LevelSupply
+            with `workers` worker processes.
+        :param levels: an empty LevelList, to configure how many levels
+            stay in memory.
+        :param workers: worker processes of the default LevelSupply. Call
+            `close` (or use the game as a context manager) to stop them."""
+        self._setup(description_factory, seed, level_supply, workers)
+        if levels is not None:
+            self.levels = levels
+        self.levels.append(self.level_supply.get(0))
+        self.levels.pinned = 0
+        self.player = Player.create(self.levels[0], self.levels[0].get_random_walkable(rng=self.rng))
+        self.scheduler.add(self.player)
         for n in self.player.pos.neighbors():
             if self.levels[0].locate(n) and self.levels[0][n].is_walkable:
-                self.levels[0][n].items = [HealingPotion()]
+                self.levels[0].items.add(n, HealingPotion())
+
+    @classmethod
+    def restore(cls, description_factory, seed: int, levels: LevelList, player: Player,
+                level_supply: Optional[LevelSupply] = None) -> 'Game':
+        """Rebuilds a game from its parts (e.g. when loading a saved game).
+
+        The caller must add the creatures to the game's scheduler."""
+        game = cls.__new__(cls)
+        game._setup(description_factory, seed, level_supply)
+        game.levels = levels
+        game.player = player
+        levels.pinned = levels.index(player.level)
+        return game
+
+    def _setup(self, description_factory, seed: Optional[int], level_supply: Optional[LevelSupply],
+               workers: int = 0) -> None:
+        """Initializes everything but the levels and the player."""
+        self.rng = Rng(seed)
+        """Game-wide random stream. Subsystems use streams split from it."""
+        self.seed = self.rng.initial_seed
+        self.descriptions = description_factory
+        self.descriptions.shuffle(self.rng.split("descriptions"))
+        self.level_supply = level_supply or LevelSupply(self.rng.split("levels").initial_seed, workers=workers)
+        self.levels = LevelList()
+        """Levels visited so far. The game owns them; creatures only hold weak references."""
         self.messages = deque()
         self.commands = deque()
         self.turn = 0
+        """Number of turns the player took, including those that took no time."""
+        self.scheduler = Scheduler()
+        """Runs the creatures between the player's actions."""
+        self.stats = None
+        """CommandStats, when enabled with `enable_stats`."""
+        self.log = None
+        """CommandLog that records the commands passed to `add_command`, if any."""
+        self.events = EventBus()
+        """Where commands publish what happens. Events are dispatched at the end of each turn."""
+        self._dispatching = False
+
+    def close(self) -> None:
+        """Stops the level supply's worker processes, if any."""
+        self.level_supply.close()
+
+    def __enter__(self) -> 'Game':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @property
+    def depth(self) -> int:
+        """Index of the player's current level."""
+        return self.levels.index(self.player.level)
+
+    def descend(self) -> None:
+        """Moves the player to the next level, building it if needed."""
+        depth = self.depth + 1
+        if depth == len(self.levels):
+            # Take ownership before the player gets a weak reference to it
+            self.levels.append(self.level_supply.get(depth))
+        level = self.levels[depth]
+        self.levels.pinned = depth
+        self.player.enter(level, level.get_random_walkable(rng=self.rng))
+        self.events.publish(LevelEntered(self.player, level, depth))
 
     def add_message(self, msg: str):
         self.messages.appendleft(msg)
@@ -59,17 +310,68 @@ class Game():
         self.messages.appendleft(InventoryQuery(self, callback, filter))
 
     def handle_command(self, cmd: Command):
-        cmd.game = self
-        self.commands.extendleft(cmd.execute() or [])
+        followups = cmd.execute(self)
+        if followups:
+            self.commands.extendleft(reversed(followups))
 
     def add_command(self, cmd: Command):
+        """Queues `cmd` and runs the queue.
+
+        Commands added while the queue is running (e.g. by a callback)
+        are only queued: the running dispatch will pick them up."""
         self.commands.append(cmd)
-        self.dispatch()
+        if not self._dispatching:
+            if self.log is not None:
+                self.log.record(self, cmd)
+            self.dispatch(cmd.cost)
+
+    def dispatch(self, cost: int = 0):
+        """Runs the queued commands, which make up one turn, then
+        dispatches the turn's events.
+
+        :param cost: energy spent by the player. If not 0, the other
+            creatures act until the player's next turn."""
+        self._dispatching = True
+        try:
+            while self.commands:
+                self.handle_command(self.commands.popleft())
+            if cost:
+                self.scheduler.play(self, self.player, cost)
+        finally:
+            self._dispatching = False
+        self.turn += 1
+        self.events.flush(self.turn)
+
+    def enable_stats(self) -> CommandStats:
+        """Starts timing every command. Returns the (new) statistics."""
+        self.stats = CommandStats()
+        # Shadowing the method keeps the normal path free of checks
+        self.handle_command = self._timed_handle_command
+        return self.stats
+
+    def disable_stats(self) -> None:
+        """Stops timing commands."""
+        self.__dict__.pop("handle_command", None)
+        self.stats = None
+
+    def _timed_handle_command(self, cmd: Command):
+        start = perf_counter()
+        followups = cmd.execute(self) or ()
+        self.stats.record(type(cmd), perf_counter() - start, len(followups))
+        self.commands.extendleft(reversed(followups))
 
-    def dispatch(self):
-        while self.commands:
-            self.handle_command(self.commands.popleft())
+    def profile_next_turn(self, path: str) -> None:
+        """Runs the next command passed to `add_command`, and all its
+        follow-ups, under cProfile and dumps the result to `path`."""
+        import cProfile
+        def add_command(cmd: Command):
+            del self.add_command
+            profiler = cProfile.Profile()
+            profiler.runcall(self.add_command, cmd)
+            profiler.dump_stats(path)
+        self.add_command = add_command
 
     def destroy_item(self, item: Item):
         """Removes an item from the game."""
-        self.player.inventory.remove(item)
\ No newline at end of file
+        self.player.inventory.remove(item)
+        self.events.publish(ItemDestroyed(item))
\ No newline at end of file
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Item layer.
+
+The items lying on a level are kept in a sparse index, keyed by the
+row-major offset of their square, next to a bitset (see `Visibility`) of
+the offsets that hold items. Only squares with items cost anything, and
+queries over an area are a mask operation followed by one lookup per
+square that holds items.
+
+Each change bumps the layer's version, so that a renderer can ask which
+squares changed since the version it last drew (see `changed`). Only
+recent changes of squares that no longer hold items are remembered.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from models.position import Position, at
+from models.visibility import offsets
+
+class ItemLayer():
+    """Items lying on the squares of a level."""
+    MAX_EMPTIED = 64
+    """Number of emptied squares whose changes are kept past those that
+    hold items, before they are dropped."""
+
+    def __init__(self):
+        self._cells = {}    # type: Dict[int, Tuple['Item', ...]]
+        """Items on each square that holds some, bottom first."""
+        self.mask = 0
+        """Bitset of the squares that hold items."""
+        self.version = 0
+        """Incremented whenever items are added or removed."""
+        self._changed = {}  # type: Dict[int, int]
+        """Version of the last change of each square that holds items, or
+        held some since `_forgotten`."""
+        self._forgotten = 0
+        """Changes up to this version may have been dropped from `_changed`."""
+
+    def attach(self, offset: int, square: 'Square') -> None:
+        """Moves the items of `square` into the layer, at `offset`."""
+        items = square._own_items
+        if items:
+            square._own_items = None
+            self._set(offset, self._cells.get(offset, ()) + tuple(items))
+
+    def detach(self, offset: int, square: 'Square') -> None:
+        """Moves the items at `offset` back into `square`."""
+        items = self._cells.get(offset)
+        if items:
+            square._own_items = list(items)
+            self._set(offset, ())
+
+    def at(self, pos: Position) -> Tuple['Item', ...]:
+        """Returns the items at `pos`, bottom first."""
+        return self._cells.get(pos.offset, ())
+
+    def at_offset(self, offset: int) -> Tuple['Item', ...]:
+        """Returns the items on the square at row-major `offset`, bottom first."""
+        return self._cells.get(offset, ())
+
+    def add(self, pos: Position, item: 'Item') -> None:
+        """Drops `item` at `pos`, on top of the items already there."""
+        offset = pos.offset
+        self._set(offset, self._cells.get(offset, ()) + (item,))
+
+    def remove(self, pos: Position, item: 'Item') -> None:
+        """Removes `item` from `pos`. Raises ValueError if it isn't there."""
+        offset = pos.offset
+        items = list(self._cells.get(offset, ()))
+        items.remove(item)
+        self._set(offset, tuple(items))
+
+    def pop(self, pos: Position) -> 'Item':
+        """Removes and returns the top item at `pos`. Raises IndexError if there is none."""
+        offset = pos.offset
+        items = self._cells.get(offset)
+        if not items:
+            raise IndexError("no items at {}".format(pos))
+        self._set(offset, items[:-1])
+        return items[-1]
+
+    def put(self, pos: Position, items: List['Item']) -> None:
+        """Replaces the items at `pos`."""
+        self._set(pos.offset, tuple(items))
+
+    def in_mask(self, mask: int) -> Iterator[Tuple[Position, Tuple['Item', ...]]]:
+        """Yields the (position, items) couples of the squares of `mask`
+        that hold items, in row-major order.
+
+        Use the player's field of view, or the known squares, as mask
+        to get the items in view."""
+        cells = self._cells
+        for offset in offsets(self.mask & mask):
+            yield at(offset), cells[offset]
+
+    def in_rect(self, bbox: Tuple[int, int, int, int]) -> Iterator[Tuple[Position, Tuple['Item', ...]]]:
+        """Yields the (position, items) couples of the squares that hold
+        items in `bbox` (left, top, right, bottom, inclusive), in
+        row-major order."""
+        return self.in_mask(rect_mask(bbox))
+
+    def all(self) -> Iterator[Tuple[Position, Tuple['Item', ...]]]:
+        """Yields the (position, items) couples of all the squares that
+        hold items, in row-major order."""
+        cells = self._cells
+        for offset in sorted(cells):
+            yield at(offset), cells[offset]
+
+    def changed(self, version: int) -> Optional[List[int]]:
+        """Returns the offsets of the squares whose items changed after
+        `version`, or None if the changes are too old to list."""
+        if version == self.version:
+            return []
+        if version < self._forgotten:
+            return None
+        return [offset for offset, changed in self._changed.items() if changed > version]
+
+    def _set(self, offset: int, items: Tuple['Item', ...]) -> None:
+        if items:
+            self._cells[offset] = items
+            self.mask |= 1 << offset
+        elif self._cells.pop(offset, None) is not None:
+            self.mask &= ~(1 << offset)
+        else:
+            return
+        self.version += 1
+        self._changed[offset] = self.version
+        if len(self._changed) - len(self._cells) > self.MAX_EMPTIED:
+            self._forget()
+
+    def _forget(self) -> None:
+        """Drops the changes of the squares that no longer hold items."""
+        cells = self._cells
+        for offset, changed in list(self._changed.items()):
+            if offset not in cells:
+                del self._changed[offset]
+                self._forgotten = max(self._forgotten, changed)
+
+def rect_mask(bbox: Tuple[int, int, int, int]) -> int:
+    """Returns the bitset of the cells in `bbox` (left, top, right, bottom,
+    inclusive), clipped to the screen."""
+    width = Position.SCREEN_W
+    left, top = max(0, bbox[0]), max(0, bbox[1])
+    right, bottom = min(width - 1, bbox[2]), min(Position.SCREEN_H - 1, bbox[3])
+    if left > right or top > bottom:
+        return 0
+    row = ((1 << (right - left + 1)) - 1) << left
+    mask = 0
+    for r in range(top, bottom + 1):
+        mask |= row << (r * width)
+    return mask
@@ -1,13 +1,14 @@
 # -*- coding: utf-8 -*-
 
 from enum import Enum
-from typing import Tuple, List, Optional
+from typing import Dict, Tuple, List, Optional
 from random import randrange
 
 from rnd.dice import d
 
 from models.player import Player
 from helpers.commands import Heal, AddMessage
+from helpers.registry import register
 #from models.events import Heal
 
 def Category(cls):
@@ -24,34 +25,44 @@ class Item():
     category = None
     beatitude = None
     beatitude_known = False
+    registry = {}   # type: Dict[int, type]
+    """Every item class, by `registry_id`.
 
-class HasEffect(Item):
+    Save files and command logs store the ids, so each subclass declares
+    its own (e.g. `class Potion(Item, registry_id=2)`), and ids must never
+    be changed or reused."""
+
+    def __init_subclass__(cls, registry_id: Optional[int] = None, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.registry_id = register(Item.registry, cls, registry_id)
+
+class HasEffect(Item, registry_id=0):
     """Item that has an effect (can be quaffed, read, applied etc.).
     
     Returns a list of messages to be displayed."""
     def effect(creature: 'Creature', *args) -> Optional[List[str]]:
         raise NotImplementedError("This is an interface.")
 
-class SingleUse(HasEffect):
+class SingleUse(HasEffect, registry_id=1):
     auto_discovery = True
     """Healing item."""
     def effect(self, creature: 'Creature', base: int, roll: Tuple[int, int] = (0,0)) -> Optional[List[str]]:
         creature.health.heal(base + d(*roll))
 
 @Category
-class Potion(Item):
+class Potion(Item, registry_id=2):
     pass
 
 @Category
-class Scroll(Item):
+class Scroll(Item, registry_id=3):
     pass
 
-class HealingScroll(Scroll):
+class HealingScroll(Scroll, registry_id=4):
     auto_discovery = True
     def effect(self, creature):
         super().effect(creature, 1)
 
-class HealingPotion(Potion):
+class HealingPotion(Potion, registry_id=5):
     auto_discovery = True
     def effect(self, creature):
         return Heal(creature, 3)
\ No newline at end of file
@@ -1,16 +1,18 @@
 from collections import deque
 from enum import Enum
 from functools import lru_cache
+from heapq import heappush, heappop
 from itertools import chain
 from math import inf
-from random import randint, shuffle, choice, sample
-from typing import List, Tuple, Dict, Union, Optional, Iterator, Generator
+from operator import and_
+from typing import List, Tuple, Dict, Union, Optional, Iterator, Iterable, Generator
 
-import networkx as nx
-
-from models.position import Position, position
-from models.direction import Direction
-from rnd.dice import d, coin
+from models.position import Position, at, neighbor_offsets, offset_of, position
+from models.distance import DistanceMaps
+from models.fov import FieldOfView
+from models.itemlayer import ItemLayer
+from models.visibility import Visibility, from_bytes
+from rnd.dice import Rng, global_rng
 
 class SquareType(Enum):
     # Walkable types
@@ -29,18 +31,87 @@ class Square():
     """Generic map square.
 
     The Square is the baase element of a level. It can hold
-    creatures and items. The `type` attribute specializes the square."""
-    __slots__ = "pos", "type", "known", "_lit", "items"
+    creatures and items. The `type` attribute specializes the square.
+
+    Once the square is in a level, its flags are stored in the level's
+    `Visibility` layer and its items in the level's `ItemLayer`, and its
+    attributes are views on them."""
+    __slots__ = "pos", "type", "_own_items", "_own_known", "_own_lit", "_layer", "_offset"
 
     def __init__(self, sq_type: SquareType):
         self.type = sq_type
-        self.known = False
+        self._own_known = False
+        self._own_lit = False
+        self._layer = None
+        """The Visibility layer holding the flags, if any."""
+        self._offset = 0
+        """Offset of the square in the layer."""
+        self._own_items = None
+        """Items of a square that isn't in a level (None when there are none)."""
+
+    def __getstate__(self):
+        return self.type, self.known, self._lit, self.items
+
+    def __setstate__(self, state):
+        self.type, self._own_known, self._own_lit, items = state
+        self._own_items = list(items) or None
+        self._layer, self._offset = None, 0
+
+    @property
+    def items(self) -> Tuple['Item', ...]:
+        """Items lying on the square, bottom first. Use the level's
+        `ItemLayer` to change them."""
+        layer = self._layer
+        if layer is None:
+            return tuple(self._own_items or ())
+        return layer.level.items.at_offset(self._offset)
+
+    @items.setter
+    def items(self, items: List['Item']):
+        layer = self._layer
+        if layer is None:
+            self._own_items = list(items) or None
+        else:
+            layer.level.items.put(at(self._offset), items)
+
+    @property
+    def known(self) -> bool:
         """When False, the square is hidden from the map."""
-        self._lit = False
-        self.items = []
-    
+        layer = self._layer
+        if layer is None:
+            return self._own_known
+        return layer.known >> self._offset & 1 == 1
+
+    @known.setter
+    def known(self, value: bool):
+        layer = self._layer
+        if layer is None:
+            self._own_known = value
+        elif value:
+            layer.known |= 1 << self._offset
+        else:
+            layer.known &= ~(1 << self._offset)
+
     @property
-    def lit(self):
+    def _lit(self) -> bool:
+        """Whether the square is lit, regardless of its type."""
+        layer = self._layer
+        if layer is None:
+            return self._own_lit
+        return layer.lit >> self._offset & 1 == 1
+
+    @_lit.setter
+    def _lit(self, value: bool):
+        layer = self._layer
+        if layer is None:
+            self._own_lit = value
+        elif value:
+            layer.lit |= 1 << self._offset
+        else:
+            layer.lit &= ~(1 << self._offset)
+
+    @property
+    def lit(self) -> bool:
         """When True, the player can "see" the Square."""
         return self._lit or (self.known and not self.is_walkable)
 
@@ -58,17 +129,72 @@ class SquareStore(dict):
 
     A SquareStore is a Position->Square mapping that can perform
     some additional operations."""
+    level = None
+    """The Level that indexes this store, if any.
+
+    Changes to the store are forwarded to the level's square index."""
+
     def __init__(self, *args, **kwargs):
         self.update(*args, **kwargs)
 
+    def __setitem__(self, pos: Position, square: 'Square') -> None:
+        super().__setitem__(pos, square)
+        if self.level is not None:
+            self.level._index(pos, self, square)
+
+    def __delitem__(self, pos: Position) -> None:
+        super().__delitem__(pos)
+        if self.level is not None:
+            self.level._unindex(pos, self)
+
+    def update(self, *args, **kwargs) -> None:
+        if self.level is None:
+            super().update(*args, **kwargs)
+        else:
+            for pos, square in dict(*args, **kwargs).items():
+                self[pos] = square
+
+    def pop(self, pos: Position, *default) -> 'Square':
+        if pos in self:
+            square = self[pos]
+            del self[pos]
+            return square
+        return super().pop(pos, *default)
+
+    def setdefault(self, pos: Position, square: 'Square') -> 'Square':
+        """Unlike `dict.setdefault`, `square` is required: a store only holds Squares."""
+        if pos not in self:
+            self[pos] = square
+        return self[pos]
+
+    def popitem(self) -> Tuple[Position, 'Square']:
+        pos, square = super().popitem()
+        if self.level is not None:
+            self.level._unindex(pos, self)
+        return pos, square
+
+    def clear(self) -> None:
+        if self.level is None:
+            super().clear()
+        else:
+            for pos in list(self):
+                del self[pos]
+
+    def __ior__(self, other) -> 'SquareStore':
+        self.update(other)
+        return self
+
     def switch_lights(self, switch: bool) -> None:
         """Turns the light on/off on all squares."""
+        if self.level is not None:
+            self.level.visibility.switch(self.level.mask(self), switch)
+            return
         for _, sq in self.items():
             sq.lit = switch
 
-    def get_random_walkable(self) -> Position:
+    def get_random_walkable(self, rng: Optional[Rng] = None) -> Position:
         """Returns a random Position mapped to a walkable Square."""
-        return choice([i for i in self if self[i].is_walkable])
+        return (rng or global_rng).choice([i for i in self if self[i].is_walkable])
     
 class Room(SquareStore):
     """A room."""
@@ -84,51 +210,57 @@ class Room(SquareStore):
         """Room "height" (vertical span)."""
         self.lit = True
         """When True, """
+        self._bbox = (top_left.col, top_left.row, top_left.col + width - 1, top_left.row + height - 1)
         super().__init__(self._build_squares())
 
     def switch_lights(self, switch):
         super().switch_lights(switch and self.lit)
         if switch and self.lit:
+            if self.level is not None:
+                self.level.visibility.discover(self.level.mask(self))
+                return
             for pos in self:
                 self[pos].known = True
 
 
     @classmethod
-    def create(cls) -> 'Room':
+    def create(cls, rng: Optional[Rng] = None) -> 'Room':
         """Factory method."""
-        width = cls._MIN_DIM + d(*cls._W_DICE) - 1
-        height = cls._MIN_DIM + d(*cls._H_DICE) - 1
+        rng = rng or global_rng
+        width, height = cls.random_size(rng)
         top_left = position(
-            randint(0, Position.SCREEN_W - width-1),
-            randint(0, Position.SCREEN_H - height-1))
+            rng.randint(0, Position.SCREEN_W - width-1),
+            rng.randint(0, Position.SCREEN_H - height-1))
         return Room(top_left, width, height)
 
+    @classmethod
+    def random_size(cls, rng: Rng) -> Tuple[int, int]:
+        """Rolls the (width, height) of a new room."""
+        return cls._MIN_DIM + rng.d(*cls._W_DICE) - 1, cls._MIN_DIM + rng.d(*cls._H_DICE) - 1
+
     def _intersect(self, other: 'Room', margin: int = 0) -> bool:
         """Checks if `self` intersects `other` or vice versa."""
-        return not any((
-            self.bbox[0] > other.bbox[2]+margin,       #self right of other
-            self.bbox[2] < other.bbox[0]-margin,       #self left of other
-            self.bbox[1] > other.bbox[3]+margin,       #self below other
-            self.bbox[3] < other.bbox[1]-margin,       #self above other
-        ))
+        return _intersect(self._bbox, other._bbox, margin)
 
     def _build_squares(self) -> Dict[Position, Square]:
         """ Creates the dictionary of squares for the room. """
         b = self.bbox
+        # The corners are validated, so the squares between them are on the map
         sq = {p: Square(t) for p, t in zip(self.corners, (SquareType.WALL_TL, SquareType.WALL_BL, SquareType.WALL_BR, SquareType.WALL_TR))}
+        width = Position.SCREEN_W
         for idx in range(4):
             if idx % 2:     # Odd = horizontal wall
                 sq.update({
-                    position(i, b[idx]): Square(SquareType.WALL_H) 
+                    at(b[idx] * width + i): Square(SquareType.WALL_H) 
                     for i in range(b[0]+1, b[2])
                 })
             else:           # Even = vertical wall
                 sq.update({
-                    position(b[idx], i): Square(SquareType.WALL_V) 
+                    at(i * width + b[idx]): Square(SquareType.WALL_V) 
                     for i in range(b[1]+1, b[3])
                 })
         # Fill
-        sq.update({position(i, j): Square(SquareType.ROOM) for i in range(b[0]+1, b[2]) for j in range(b[1]+1, b[3])})
+        sq.update({at(j * width + i): Square(SquareType.ROOM) for i in range(b[0]+1, b[2]) for j in range(b[1]+1, b[3])})
         return sq
 
 
@@ -137,110 +269,463 @@ class Room(SquareStore):
         """Bounding box for the room.
 
         Expressed as [top_left.col, top_left.row, bottom_right.col, bottom_right.row]."""
-        return (self.top_left.col, self.top_left.row, self.top_left.col + self.width-1, self.top_left.row + self.height-1)
+        return self._bbox
         
     @property
     def corners(self) -> Tuple[Position, Position, Position, Position]:
         """Returns positions of corners in CCW order (TL, BL, BR, TR)."""
-        return tuple(position(self.bbox[i], self.bbox[j]) for i, j in ((0, 1), (0, 3), (2, 3), (2, 1)))
+        b = self._bbox
+        return tuple(position(b[i], b[j]) for i, j in ((0, 1), (0, 3), (2, 3), (2, 1)))
+
+def _intersect(bbox: Tuple[int, int, int, int], other: Tuple[int, int, int, int], margin: int = 0) -> bool:
+    """Checks if two bounding boxes, one of them grown by `margin`, intersect."""
+    return not (
+        bbox[0] > other[2]+margin or        #bbox right of other
+        bbox[2] < other[0]-margin or        #bbox left of other
+        bbox[1] > other[3]+margin or        #bbox below other
+        bbox[3] < other[1]-margin           #bbox above other
+    )
+
+class IRoomPlacer():
+    """Interface for a room placer.
+    A room placer chooses the rooms of a new level, up to `Level.MAX_ROOMS`."""
+    def place_rooms(self, level: 'Level', rng: Optional[Rng] = None) -> List[Room]:
+        """Returns the rooms for a given Level."""
+        raise NotImplementedError("This is an abstract class.")
+
+class RejectionRoomPlacer(IRoomPlacer):
+    """Implementation of a room placer that draws random rooms, and keeps
+    those that don't overlap the previous ones.
+
+    Gives up after `Level.MAX_ATTEMPTS` draws, so levels may have fewer
+    than `Level.MAX_ROOMS` rooms."""
+    def place_rooms(self, level: 'Level', rng: Optional[Rng] = None) -> List[Room]:
+        rng = rng or global_rng
+        bboxes, rooms = [], []
+        for __ in range(level.MAX_ATTEMPTS):
+            if len(rooms) == level.MAX_ROOMS:
+                break
+            width, height = Room.random_size(rng)
+            col = rng.randint(0, Position.SCREEN_W - width-1)
+            row = rng.randint(0, Position.SCREEN_H - height-1)
+            bbox = (col, row, col + width - 1, row + height - 1)
+            # Squares are only built for rooms that are kept
+            if not any(_intersect(bbox, other, rng.randint(3, 6)) for other in bboxes):
+                bboxes.append(bbox)
+                rooms.append(Room(position(col, row), width, height))
+        return rooms
+
+class GridRoomPlacer(IRoomPlacer):
+    """Implementation of a room placer that tracks free space on an occupancy grid.
+
+    The grid holds one bitmask of blocked columns per row. For each
+    room, a few shifts and ANDs of these masks give every top-left
+    corner where a room of the rolled size fits, and one of them is
+    picked at random. Like `RejectionRoomPlacer`, rooms are kept apart
+    by a random margin. If nothing fits, the room shrinks, then the
+    margins do, until it fits: levels get `Level.MAX_ROOMS` rooms
+    whenever there is space for them."""
+    MARGINS = (3, 6)
+    """Range of the number of free columns or rows around each room."""
+    MIN_MARGIN = 1
+    """Smallest margin used when the map is too crowded for `MARGINS`."""
+
+    def place_rooms(self, level: 'Level', rng: Optional[Rng] = None) -> List[Room]:
+        rng = rng or global_rng
+        blocked = [0] * Position.SCREEN_H
+        rooms, margins = [], []
+        for __ in range(level.MAX_ROOMS):
+            room_w, room_h = Room.random_size(rng)
+            candidates, (room_w, room_h) = self._candidates(blocked, room_w, room_h)
+            limit = self.MARGINS[1]
+            while not candidates and limit > self.MIN_MARGIN:
+                # Only crowded maps get here: bring the rooms closer
+                limit -= 1
+                crowded = [0] * Position.SCREEN_H
+                for room, margin in zip(rooms, margins):
+                    self._block(crowded, room.bbox, min(margin, limit))
+                candidates, (room_w, room_h) = self._candidates(crowded, room_w, room_h)
+            if not candidates:
+                break
+            count = sum(bin(row).count("1") for row in candidates)
+            room = Room(at(self._nth(candidates, rng.randrange(count))), room_w, room_h)
+            rooms.append(room)
+            margins.append(rng.randint(*self.MARGINS))
+            self._block(blocked, room.bbox, margins[-1])
+        return rooms
+
+    @staticmethod
+    def _block(blocked: List[int], bbox: Tuple[int, int, int, int], margin: int) -> None:
+        """Marks `bbox`, grown by `margin`, as blocked."""
+        left, right = max(0, bbox[0] - margin), min(Position.SCREEN_W - 1, bbox[2] + margin)
+        mask = ((1 << (right - left + 1)) - 1) << left
+        for row in range(max(0, bbox[1] - margin), min(Position.SCREEN_H, bbox[3] + margin + 1)):
+            blocked[row] |= mask
+
+    @classmethod
+    def _candidates(cls, blocked: List[int], room_w: int, room_h: int) -> Tuple[List[int], Tuple[int, int]]:
+        """Returns the top-left corners where a room fits (see `_fits`), or
+        an empty list, and its size: the given one, or the largest smaller
+        one that fits."""
+        full = (1 << Position.SCREEN_W) - 1
+        free = [~row & full for row in blocked]
+        candidates = cls._fits(free, room_w, room_h)
+        while not candidates and (room_w > Room._MIN_DIM or room_h > Room._MIN_DIM):
+            room_w, room_h = max(Room._MIN_DIM, room_w - 1), max(Room._MIN_DIM, room_h - 1)
+            candidates = cls._fits(free, room_w, room_h)
+        return candidates, (room_w, room_h)
+
+    @staticmethod
+    def _fits(free: List[int], room_w: int, room_h: int) -> List[int]:
+        """Returns the top-left corners where a room of the given size covers
+        only free cells, as one bitmask of columns per row, or an empty
+        list if there are none. Like `Room.create`, rooms don't touch the
+        right and bottom edges of the map."""
+        # Bit c of row r: cells c to c + span - 1 of row r are free. The
+        # span doubles at each step, so wide rooms take few steps.
+        rows, span = list(free), 1
+        while span < room_w:
+            step = min(span, room_w - span)
+            rows = [row & (row >> step) for row in rows]
+            span += step
+        # Same thing across rows: entry r covers rows r to r + span - 1
+        span = 1
+        while span < room_h:
+            step = min(span, room_h - span)
+            rows = list(map(and_, rows, rows[step:]))
+            span += step
+        columns = (1 << (Position.SCREEN_W - room_w)) - 1
+        fits = [row & columns for row in rows[:Position.SCREEN_H - room_h]]
+        return fits if any(fits) else []
+
+    @staticmethod
+    def _nth(fits: List[int], n: int) -> int:
+        """Returns the offset of the `n`-th corner of `fits`, in row-major order."""
+        for row, columns in enumerate(fits):
+            count = bin(columns).count("1")
+            if n < count:
+                break
+            n -= count
+        digits, col = format(columns, "b")[::-1], -1
+        for __ in range(n + 1):
+            col = digits.index("1", col + 1)
+        return row * Position.SCREEN_W + col
 
 class ICorridorFactory():
     """Interface for a corridor factory.
     A corridor factory should build a suitable set of CORRIDOR and DOORWAY squares
     for the given level."""
-    def make_corridors(self, level: 'Level') -> SquareStore:
+    def make_corridors(self, level: 'Level', rng: Optional[Rng] = None) -> SquareStore:
         """Returns the "Corridor" SquareStore for a given Level."""
         raise NotImplementedError("This is an abstract class.")
 
-class CorridorFactory():
-    """Implementation of a corridor factory"""
-    def make_corridors(self, level: 'Level') -> SquareStore:
-        def heuristic(pos1: tuple, pos2: tuple) -> Union[float, int]:
-            """A* heuristic for corridor creation (Manhattan distance)."""
-            if any(level.locate(p) for p in (pos1, pos2)):
-                return inf      # Avoid squares that contain something other than corridors
-            return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1])
-
-        result = SquareStore()
-        graph = nx.grid_2d_graph(Position.SCREEN_W, Position.SCREEN_H)
+    @staticmethod
+    def _room_sequence(level: 'Level', rng: Rng) -> List[Room]:
+        """Returns the order in which rooms get connected."""
         # Sorts the rooms and then swaps them, in order to get a not-so-random dungeon
         rooms = sorted(list(level.rooms), key= lambda r: r.top_left)
         swaps = 0
-        while d(1, 4) > 1 and swaps < len(level.rooms):
-            a, b = sample(range(len(level.rooms)), 2)
+        while rng.d(1, 4) > 1 and swaps < len(level.rooms):
+            a, b = rng.sample(range(len(level.rooms)), 2)
             rooms[a], rooms[b] = rooms[b], rooms[a]
             swaps += 1
-        graph.remove_nodes_from(pos for r in rooms for pos in r)#.squares)
-        for r1, r2 in zip(rooms, rooms[1:]):
-            start, end = CorridorFactory._rnd_doorway(r1), CorridorFactory._rnd_doorway(r2)
-            del r1[start]
-            del r2[end]
-            for p in start, end:
-                graph.add_node(p)            
-                graph.add_edges_from((p, n) for n in p.neighbors(False) if level.locate(n) is None)
-                result[position(*p)] = Square(SquareType.DOORWAY)
-            path = nx.astar_path(graph, start, end, heuristic)
-            result.update({position(*pos): Square(SquareType.CORRIDOR) for pos in path[1:-1]})
-            graph.remove_nodes_from((start, end))   # Avoid using doorways in next computations
-        return result
+        return rooms
 
     @staticmethod
-    def _rnd_doorway(room: Room) -> Position:
+    def _rnd_doorway(room: Room, rng: Rng) -> Position:
         tl, __, br, __ = room.corners
         candidates = [
-            tl + (randint(1, room.width-1), 0),
-            tl + (0, randint(1, room.height-1)),
-            br - (randint(1, room.width-1), 0),
-            br - (0, randint(1, room.height-1))
+            tl + (rng.randint(1, room.width-1), 0),
+            tl + (0, rng.randint(1, room.height-1)),
+            br - (rng.randint(1, room.width-1), 0),
+            br - (0, rng.randint(1, room.height-1))
         ]
         candidates[:] = [
             pos for pos in candidates 
-            if CorridorFactory._is_valid_doorway(pos) 
+            if ICorridorFactory._is_valid_doorway(pos) 
             and pos in room#.squares
             and room[pos].type in (SquareType.WALL_H, SquareType.WALL_V)
         ]
         if candidates:
-            p = choice(candidates)
+            p = rng.choice(candidates)
             return position(*p)
         else:
-            return CorridorFactory._rnd_doorway(room)
+            return ICorridorFactory._rnd_doorway(room, rng)
         
     @staticmethod
     def _is_valid_doorway(pos: Position) -> bool:
         """Doorways can't be placed on the map's edge."""
         return 1 <= pos.col <= Position.SCREEN_W - 1 and 1 <= pos.row <= Position.SCREEN_H - 1
 
+class CorridorFactory(ICorridorFactory):
+    """Implementation of a corridor factory, based on networkx."""
+    def make_corridors(self, level: 'Level', rng: Optional[Rng] = None) -> SquareStore:
+        # networkx is slow to import, and only needed by this factory
+        import networkx as nx
+
+        def heuristic(pos1: tuple, pos2: tuple) -> Union[float, int]:
+            """A* heuristic for corridor creation (Manhattan distance)."""
+            if any(level.locate(p) for p in (pos1, pos2)):
+                return inf      # Avoid squares that contain something other than corridors
+            return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1])
+
+        result = SquareStore()
+        rng = rng or global_rng
+        graph = nx.grid_2d_graph(Position.SCREEN_W, Position.SCREEN_H)
+        rooms = self._room_sequence(level, rng)
+        graph.remove_nodes_from(pos for r in rooms for pos in r)#.squares)
+        for r1, r2 in zip(rooms, rooms[1:]):
+            start, end = self._rnd_doorway(r1, rng), self._rnd_doorway(r2, rng)
+            del r1[start]
+            del r2[end]
+            for p in start, end:
+                graph.add_node(p)            
+                graph.add_edges_from((p, n) for n in p.neighbors(False) if level.locate(n) is None)
+                result[position(*p)] = Square(SquareType.DOORWAY)
+            path = nx.astar_path(graph, start, end, heuristic)
+            result.update({position(*pos): Square(SquareType.CORRIDOR) for pos in path[1:-1]})
+            graph.remove_nodes_from((start, end))   # Avoid using doorways in next computations
+        return result
+
+class GridCorridorFactory(ICorridorFactory):
+    """Implementation of a corridor factory that runs A* on an occupancy grid.
+
+    Positions are flattened to row-major offsets. Room squares are
+    marked once per level in a blocked mask, and the search buffers
+    are allocated once and reused for every pair of rooms."""
+
+    def __init__(self):
+        size = Position.SCREEN_W * Position.SCREEN_H
+        self._cost = [0] * size
+        self._parent = [0] * size
+        self._visited = [0] * size
+        """Holds the id of the last search that reached each cell."""
+        self._search = 0
+        self._neighbors = neighbor_offsets(False)
+        """Offsets of the 4 neighbors of each grid cell."""
+
+    def make_corridors(self, level: 'Level', rng: Optional[Rng] = None) -> SquareStore:
+        rng = rng or global_rng
+        width = Position.SCREEN_W
+        result = SquareStore()
+        blocked = bytearray(width * Position.SCREEN_H)
+        rooms = self._room_sequence(level, rng)
+        for room in rooms:
+            for col, row in room:
+                blocked[row * width + col] = 1
+        for r1, r2 in zip(rooms, rooms[1:]):
+            start, end = self._rnd_doorway(r1, rng), self._rnd_doorway(r2, rng)
+            del r1[start]
+            del r2[end]
+            # Doorways stay blocked, so that next computations can't use them
+            for p in start, end:
+                result[p] = Square(SquareType.DOORWAY)
+            path = self._astar(blocked, start.row * width + start.col, end.row * width + end.col)
+            result.update({at(i): Square(SquareType.CORRIDOR) for i in path})
+        return result
+
+    def _astar(self, blocked: bytearray, start: int, end: int) -> List[int]:
+        """Returns the cells strictly between `start` and `end` on a shortest path.
+
+        Only `start` and `end` may be blocked. If no path exists,
+        returns an empty list."""
+        width = Position.SCREEN_W
+        cost, parent, visited, neighbors = self._cost, self._parent, self._visited, self._neighbors
+        self._search += 1
+        search = self._search
+        end_col, end_row = end % width, end // width
+        cost[start] = 0
+        visited[start] = search
+        heap = [(0, 0, start)]
+        while heap:
+            __, g, cell = heappop(heap)
+            if cell == end:
+                path = []
+                cell = parent[end]
+                while cell != start:
+                    path.append(cell)
+                    cell = parent[cell]
+                path.reverse()
+                return path
+            if g > cost[cell]:
+                continue        # Stale heap entry
+            g += 1
+            for n in neighbors[cell]:
+                if blocked[n] and n != end:
+                    continue
+                if visited[n] != search or g < cost[n]:
+                    visited[n] = search
+                    cost[n] = g
+                    parent[n] = cell
+                    heappush(heap, (g + abs(n % width - end_col) + abs(n // width - end_row), g, n))
+        return []
+
 class Level():
     """A dungeon level."""
 
     MAX_ROOMS = 9
     """Maximum number of rooms in a level"""
     MAX_ATTEMPTS = 400
-    """Maximum number of attempts before the generator gives up."""
-
-    def __init__(self):
-        """Builds a random dungeon level."""
-        self.rooms = deque(maxlen=self.MAX_ROOMS)
+    """Maximum number of rooms drawn by `RejectionRoomPlacer` before it gives up."""
+    corridor_factory = GridCorridorFactory()
+    """Default corridor factory."""
+    room_placer = GridRoomPlacer()
+    """Default room placer."""
+
+    def __init__(self, rooms: Optional[Iterable[Room]] = None, corridors: Optional[Iterable[SquareStore]] = None,
+                 corridor_factory: Optional[ICorridorFactory] = None, rng: Optional[Rng] = None,
+                 room_placer: Optional[IRoomPlacer] = None):
+        """Builds a dungeon level.
+
+        :param rooms: use these rooms instead of placing random ones.
+        :param corridors: use these corridors instead of generating them.
+        :param corridor_factory: overrides `Level.corridor_factory`.
+        :param room_placer: overrides `Level.room_placer`.
+        :param rng: random stream for the level. Rooms and corridors
+            use separate streams split from it."""
+        rng = rng or Rng()
+        self._grid = [None] * (Position.SCREEN_W * Position.SCREEN_H)
+        """Dense Position->(feature, square) index, in row-major order."""
+        self.version = 0
+        """Incremented whenever a square is added or removed."""
+        self.visibility = Visibility(self)
+        """Known and lit flags of the squares."""
+        self.items = ItemLayer()
+        """Items lying on the squares."""
+        self._masks = {}
+        """Cached results of `mask` and `room_mask`, for the current version."""
+        self._masks_version = None
+        self._fov = None
+        self._distances = None
         self.corridors = []
-        for __ in range(self.MAX_ATTEMPTS):
-            if len(self.rooms) == self.MAX_ROOMS:
-                break
-            new_room = Room.create()
-            if not any(new_room._intersect(room, randint(3, 6)) for room in self.rooms):
-                self.rooms.append(new_room)
-        factory = CorridorFactory()
-        self.corridors = [factory.make_corridors(self)]
-
-    def get_random_walkable(self, with_corridors: bool=False) -> Square:
+        if rooms is None:
+            self.rooms = deque(maxlen=self.MAX_ROOMS)
+            for room in (room_placer or self.room_placer).place_rooms(self, rng.split("rooms")):
+                self._add_feature(self.rooms, room)
+        else:
+            self.rooms = deque()
+            for room in rooms:
+                self._add_feature(self.rooms, room)
+        if corridors is None:
+            corridors = [(corridor_factory or self.corridor_factory).make_corridors(self, rng.split("corridors"))]
+        for corridor in corridors:
+            self._add_feature(self.corridors, corridor)
+
+    def __getstate__(self):
+        # The index is rebuilt on unpickling, which is cheaper than pickling it
+        state = self.__dict__.copy()
+        del state["_grid"]
+        del state["visibility"]     # The squares carry their flags...
+        del state["items"]          # ...and their items
+        state["_masks"], state["_masks_version"] = {}, None
+        state["_fov"] = None
+        state["_distances"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._grid = [None] * (Position.SCREEN_W * Position.SCREEN_H)
+        self.visibility = Visibility(self)
+        self.items = ItemLayer()
+        for feature in self.features:
+            for pos, square in feature.items():
+                self._index(pos, feature, square)
+
+    def _add_feature(self, features: List[SquareStore], feature: SquareStore) -> None:
+        """Appends `feature` to `features` and adds its squares to the index."""
+        features.append(feature)
+        feature.level = self
+        for pos, square in feature.items():
+            self._index(pos, feature, square)
+
+    _offset = staticmethod(offset_of)
+    """Returns the index of `pos` in the grid, or None if it is off the map."""
+
+    def _index(self, pos: Position, feature: SquareStore, square: 'Square') -> None:
+        """Maps `pos` to `square`, which belongs to `feature`."""
+        offset = self._offset(pos)
+        if offset is not None:
+            entry = self._grid[offset]
+            if entry is not None and entry[1] is not square:
+                self.items.detach(offset, entry[1])
+                self.visibility.detach(offset, entry[1])
+            self._grid[offset] = (feature, square)
+            self.items.attach(offset, square)
+            self.visibility.attach(offset, square)
+            self.version += 1
+
+    def _unindex(self, pos: Position, feature: SquareStore) -> None:
+        """Removes `pos` from the index, if it is mapped to `feature`."""
+        offset = self._offset(pos)
+        if offset is not None:
+            entry = self._grid[offset]
+            if entry is not None and entry[0] is feature:
+                self._grid[offset] = None
+                self.items.detach(offset, entry[1])
+                self.visibility.detach(offset, entry[1])
+                self.version += 1
+
+    def mask(self, feature: Optional[SquareStore] = None) -> int:
+        """Returns the bitset (see `Visibility`) of the squares of `feature`
+        that the level indexes, or of all of them if `feature` is None.
+        The result is cached until the level changes."""
+        masks = self._mask_cache()
+        key = id(feature) if feature is not None else None
+        mask = masks.get(key)
+        if mask is None:
+            if feature is None:
+                cells = bytes(entry is not None for entry in self._grid)
+            else:
+                cells = bytearray(len(self._grid))
+                for pos in feature:
+                    offset = self._offset(pos)
+                    entry = self._grid[offset] if offset is not None else None
+                    if entry is not None and entry[0] is feature:
+                        cells[offset] = 1
+            mask = masks[key] = from_bytes(cells)
+        return mask
+
+    def room_mask(self) -> int:
+        """Returns the bitset of the squares of all rooms. The result is cached."""
+        masks = self._mask_cache()
+        mask = masks.get("rooms")
+        if mask is None:
+            mask = 0
+            for room in self.rooms:
+                mask |= self.mask(room)
+            masks["rooms"] = mask
+        return mask
+
+    def _mask_cache(self) -> dict:
+        if self._masks_version != self.version:
+            self._masks.clear()
+            self._masks_version = self.version
+        return self._masks
+
+    def get_random_walkable(self, with_corridors: bool=False, rng: Optional[Rng] = None) -> Square:
         """ Returns a random walkable position inside the level.
 
         :param with_corridors: include corridors' squares."""
-
+        rng = rng or global_rng
         if with_corridors:        
-            feature = choice(chain(self.rooms, self.corridors))
+            feature = rng.choice(list(self.features))
         else:
-            feature = choice(self.rooms)
-        return feature.get_random_walkable()
+            feature = rng.choice(self.rooms)
+        return feature.get_random_walkable(rng)
+
+    @property
+    def fov(self) -> FieldOfView:
+        """Field of view engine for the level."""
+        if self._fov is None:
+            self._fov = FieldOfView(self)
+        return self._fov
+
+    @property
+    def distances(self) -> DistanceMaps:
+        """Distance maps of the level, shared by the creatures on it."""
+        if self._distances is None:
+            self._distances = DistanceMaps(self)
+        return self._distances
 
     @property
     def features(self):
@@ -248,12 +733,11 @@ class Level():
         return chain(self.rooms, self.corridors)
 
     def __getitem__(self, pos: Position) -> Square:
-        for feature in self.features:
-            try:
-                return feature[pos]
-            except KeyError:
-                continue
-        raise KeyError
+        offset = self._offset(pos)
+        entry = self._grid[offset] if offset is not None else None
+        if entry is None:
+            raise KeyError(pos)
+        return entry[1]
 
     def squares(self) -> Generator:
         """Yields all (position, square) couples in the level"""
@@ -265,15 +749,6 @@ class Level():
         """Returns the feature (room or corridor) that contains `pos`.
 
         If no such feature exists, returns `None`."""
-        for feature in self.features:
-            if pos in feature:
-                return feature
-        return None
-        
-    @staticmethod
-    def _corridor_heuristics(level: 'Level', pos1: tuple, pos2: tuple) -> Union[float, int]:
-        """A* heuristic for corridor creation (Manhattan distance)"""
-        for p in (pos1, pos2):
-            if level.locate(p):# and level.squares()[p] != SquareType.CORRIDOR:
-                return inf      # Avoid squares that contain something other than corridors
-        return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1])
+        offset = self._offset(pos)
+        entry = self._grid[offset] if offset is not None else None
+        return entry[0] if entry is not None else None
@@ -1,15 +1,20 @@
 # -*- coding: utf-8 -*-
 from collections import deque
-from typing import Tuple, Optional, List
+from typing import Tuple, Optional, List, Set
 from weakref import ref, WeakMethod
     
 from helpers.skills import Inventory
 
 from models.direction import Direction
-from models.position import Position
+from models.position import Position, at
 from models.level import Level, Room
+from models.scheduler import ACTION_COST
+from models.visibility import neighborhood, offsets
 
 class Creature():
+    SPEED = ACTION_COST
+    """Default speed: one action per tick."""
+
     def __init__(self, level: Level, pos: Position):
         """Initializator for creatures.
 
@@ -17,19 +22,47 @@ class Creature():
         self._level = ref(level)
         self.pos = pos  
         self.health = None
+        self.speed = self.SPEED
+        """Energy gained per tick (see models.scheduler)."""
+        self.energy = 0
+        """The creature can act while this is not negative."""
 
     @property
     def level(self) -> Level:
         return self._level()
 
+    @level.setter
+    def level(self, level: Level) -> None:
+        """Creatures don't own their level: whoever passes it here must keep it alive."""
+        self._level = ref(level)
+
+    def act(self, game: 'Game') -> int:
+        """Takes the creature's turn, when the scheduler runs it.
+
+        Returns the energy spent, usually `ACTION_COST`."""
+        raise NotImplementedError("This is an abstract class.")
+
     def die(self):
         raise NotImplementedError("This is an abstract class.")
 
 class Player(Creature):
+    use_fov = False
+    """When True, lighting follows the player's field of view instead of whole rooms."""
+    FOV_RADIUS = 20
+    """How far the player can see, in squares."""
+    LIGHT_RADIUS = 1
+    """How far the player can see in dark areas, in squares."""
     
     def __init__(self, level: Level, pos: Position, name: str = "Luca"):
         super().__init__(level, pos)
         self.name = name
+        self._lit_room = None
+        """The room whose lights are on."""
+        self._lit_nearby = 0
+        """Squares of other rooms that are lit because the player is next
+        to them, as a bitset (see models.visibility)."""
+        self._visible = 0
+        """Squares lit by the field of view engine, as a bitset."""
         
     @classmethod
     def create(cls, level: Level, pos: Position) -> 'Player':
@@ -44,36 +77,99 @@ class Player(Creature):
     def square(self):
         return self.level[self.pos]
 
-    def update_lights(self) -> None:
-        """Updates the lighting in the current level."""
-        feature = self.level.locate(self.pos)
-        for f in self.level.rooms:
-            f.switch_lights(f is feature and isinstance(f, Room))
-        #for corridor in self.level.corridors:
-        #    corridor.switch_lights(False)
-        self.level[self.pos].lit = True
-        self.level[self.pos].known = True
-        for n in self.pos.neighbors(True):
-            try:
-                n_feature = self.level.locate(n)
-                if n_feature:
-                    n_feature[n].lit = True
-                    self.level[n].known = True
-            except KeyError:
+    def enter(self, level: Level, pos: Position) -> None:
+        """Moves the player to `pos` in another level."""
+        self.level = level
+        self.pos = pos
+        self._lit_room = None
+        self._lit_nearby = 0
+        self._visible = 0
+        self.update_lights()
+
+    def resume_lights(self) -> None:
+        """Rebuilds the lighting state from the level's lit squares.
+
+        Use this when the level's lighting was restored from elsewhere,
+        e.g. when loading a saved game."""
+        level = self.level
+        feature = level.locate(self.pos)
+        self._lit_room = feature if isinstance(feature, Room) else None
+        self._lit_nearby = neighborhood(self.pos.offset) & level.room_mask()
+        if self._lit_room is not None:
+            self._lit_nearby &= ~level.mask(self._lit_room)
+        self._visible = level.visibility.lit if self.use_fov else 0
+
+    def update_lights(self) -> Set[Position]:
+        """Updates the lighting in the current level.
+
+        Only squares whose lighting can change are touched: the room
+        the player left, the room the player entered and the player's
+        neighborhood. Corridor squares stay lit once seen.
+
+        Returns the positions that were updated."""
+        if self.use_fov:
+            return self._update_fov()
+        level = self.level
+        visibility = level.visibility
+        changed = set()
+        feature = level.locate(self.pos)
+        room = feature if isinstance(feature, Room) else None
+        if room is not self._lit_room:
+            for f in (self._lit_room, room):
+                if f is not None:
+                    f.switch_lights(f is room)
+                    changed.update(f)
+            self._lit_room = room
+        others = ~level.mask(room) if room is not None else -1
+        nearby = neighborhood(self.pos.offset) & level.mask()
+        lit = nearby & ~(visibility.lit & visibility.known)
+        visibility.lit |= nearby
+        visibility.known |= nearby
+        nearby &= level.room_mask() & others
+        dark = self._lit_nearby & ~nearby & level.mask() & others
+        visibility.lit &= ~dark
+        self._lit_nearby = nearby
+        changed.update(map(at, offsets(lit | dark)))
+        return changed
+
+    def _update_fov(self) -> Set[Position]:
+        """Lights the squares in the player's field of view.
+
+        Squares of lit rooms are seen from afar; anything else only
+        within `LIGHT_RADIUS`."""
+        level = self.level
+        visibility = level.visibility
+        col, row = self.pos
+        visible = 0
+        for pos in level.fov.visible(self.pos, self.FOV_RADIUS):
+            feature = level.locate(pos)
+            if feature is None:
                 continue
+            if (isinstance(feature, Room) and feature.lit) or max(abs(pos.col - col), abs(pos.row - row)) <= self.LIGHT_RADIUS:
+                visible |= 1 << pos.offset
+        lit = visible & ~(visibility.lit & visibility.known)
+        dark = self._visible & ~visible & level.mask()
+        visibility.lit = (visibility.lit | visible) & ~dark
+        visibility.known |= visible
+        self._visible = visible
+        return set(map(at, offsets(lit | dark)))
+
+    def move(self, direction: Direction) -> Set[Position]:
+        """Moves the player, if the way is free.
 
-    def move(self, direction: Direction) -> None:
+        Returns the positions whose lighting changed."""
         new_pos = self.pos + direction.value
         try:
             if self.level[new_pos].is_walkable:
                 self.pos = new_pos
-                self.update_lights()
+                return self.update_lights()
             else:
                 pass
                 # TODO: remove
                 self.health.damage(1)
         except KeyError:
-            return None
+            pass
+        return set()
 
     def die(self):
         pass
@@ -1,8 +1,6 @@
 from collections import namedtuple
-import gettext
 
-from typing import Tuple, List
-from cerberus.errors import ValidationError
+from typing import Tuple, List, Optional
 
 from helpers.validation import validate
 from models.direction import Direction
@@ -10,39 +8,94 @@ from models.direction import Direction
 _ = lambda s: s
 
 class Position(namedtuple('Position', 'col row')):
-    """Position of an object on the screen."""
+    """Position of an object on the screen.
+
+    There is a single instance of each on-screen position (see
+    `position` and `at`), and the neighbors of each are computed once."""
 
     SCREEN_W = 79
     SCREEN_H = 21
 
-    def neighbors(self, with_diagonals: bool=False):
-        """Returns all neighboring positions.
+    @property
+    def offset(self) -> int:
+        """Index of the position in a row-major screen grid."""
+        return self.row * Position.SCREEN_W + self.col
+
+    def neighbors(self, with_diagonals: bool=False) -> Tuple['Position', ...]:
+        """Returns all neighboring positions on the screen.
 
         :param with_diagonals: includes diagonal neighbors"""
-        directions = (
-            (d.value for d in Direction) 
-            if with_diagonals 
-            else (d.value for d in Direction.basic())
+        col, row = self
+        if 0 <= col < Position.SCREEN_W and 0 <= row < Position.SCREEN_H:
+            return _NEIGHBORS[with_diagonals][row * Position.SCREEN_W + col]
+        return tuple(
+            _POSITIONS[(row + dr) * Position.SCREEN_W + col + dc]
+            for dc, dr in _MOVES[with_diagonals]
+            if 0 <= col + dc < Position.SCREEN_W and 0 <= row + dr < Position.SCREEN_H
         )
-        for dc, dr in directions:
-            try:
-                yield position(self.col + dc, self.row + dr)
-            except ValidationError:
-                continue
 
     def __add__(self, other) -> 'Position':
-        return Position(self.col + other[0], self.row + other[1])
+        return _intern(self[0] + other[0], self[1] + other[1])
 
     def __sub__(self, other) -> 'Position':
-        return Position(self.col - other[0], self.row - other[1])
+        return _intern(self[0] - other[0], self[1] - other[1])
+
+    def __reduce__(self):
+        return _intern, tuple(self)
 
     def __repr__(self):
         return "<Position (%i, %i)>" % (self.col, self.row)
 
-#@validate({
-#    1: {'type': 'integer', 'min': 0, 'max': Position.SCREEN_W},
-#    2: {'type': 'integer', 'min': 0, 'max': Position.SCREEN_H},
-#})
+@validate({
+    0: {'type': 'integer', 'min': 0, 'max': Position.SCREEN_W - 1},
+    1: {'type': 'integer', 'min': 0, 'max': Position.SCREEN_H - 1},
+})
 def position(col: int, row: int) -> Position:
     """Validates parameters."""
+    return _intern(col, row)
+
+def _intern(col: int, row: int) -> Position:
+    """Returns the shared instance of an on-screen position, or a new off-screen one."""
+    if 0 <= col < Position.SCREEN_W and 0 <= row < Position.SCREEN_H:
+        return _POSITIONS[row * Position.SCREEN_W + col]
     return Position(col, row)
+
+def offset_of(pos: Tuple[int, int]) -> Optional[int]:
+    """Returns the offset of `pos` in a row-major screen grid (see
+    `Position.offset`), or None if it is off the screen."""
+    col, row = pos
+    if 0 <= col < Position.SCREEN_W and 0 <= row < Position.SCREEN_H:
+        return row * Position.SCREEN_W + col
+    return None
+
+def at(offset: int) -> Position:
+    """Returns the position at `offset` in a row-major screen grid."""
+    return _POSITIONS[offset]
+
+def neighbor_offsets(with_diagonals: bool=False) -> List[Tuple[int, ...]]:
+    """Returns the offsets of the neighbors of each cell of a row-major
+    screen grid. The result is shared: don't modify it."""
+    return _OFFSETS[with_diagonals]
+
+def _build_offsets(moves: Tuple[Tuple[int, int], ...]) -> List[Tuple[int, ...]]:
+    width, height = Position.SCREEN_W, Position.SCREEN_H
+    return [
+        tuple(
+            (row + dr) * width + col + dc
+            for dc, dr in moves
+            if 0 <= col + dc < width and 0 <= row + dr < height
+        )
+        for row in range(height) for col in range(width)
+    ]
+
+_POSITIONS = tuple(Position(col, row) for row in range(Position.SCREEN_H) for col in range(Position.SCREEN_W))
+"""The on-screen positions, in row-major order."""
+_MOVES = {
+    False: tuple(d.value for d in Direction.basic()),
+    True: tuple(d.value for d in Direction),
+}
+_OFFSETS = {diagonals: _build_offsets(moves) for diagonals, moves in _MOVES.items()}
+_NEIGHBORS = {
+    diagonals: [tuple(_POSITIONS[n] for n in cell) for cell in offsets]
+    for diagonals, offsets in _OFFSETS.items()
+}
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Command logs.
+
+A CommandLog records a game's seeds and every command passed to
+`Game.add_command`, so that the game can be replayed offline, e.g. to
+reproduce a bug or to profile a real session. Every `CHECKPOINT_EVERY`
+commands the log also stores a hash of the game's state, which `replay`
+checks.
+
+A log is a header followed by records. A record is the command's
+`registry_id` (one byte) and its fields, each made of a tag byte and
+a value; a checkpoint is a 255 byte followed by a SHA-1 digest. Items
+in the player's inventory are stored by slot, so a move takes 3 bytes.
+"""
+import struct
+from collections import namedtuple
+from enum import IntEnum
+from hashlib import sha1
+from time import perf_counter
+from typing import Iterator, Optional, Union
+
+from helpers.commands import Command
+from helpers.i18n import EnglishDescriptionFactory
+from models.direction import Direction
+from models.game import Game, LevelSupply
+from models.items import Item
+from models import savegame
+
+MAGIC = b"JGRL"
+VERSION = 3
+"""Version of the format. Logs with another version are rejected."""
+
+_HEADER = struct.Struct("<4sHQQ")
+_CHECKPOINT = 255
+_DIRECTIONS = list(Direction)
+
+class _Tag(IntEnum):
+    NONE = 0
+    DIRECTION = 1
+    SLOT = 2
+    COMMAND_TYPE = 3
+    ITEM_TYPE = 4
+    STRING = 5
+    INT = 6
+    TUPLE = 7
+    PLAYER = 8
+
+class ReplayError(Exception):
+    """The replayed game diverged from the recorded one, or the log is invalid."""
+    pass
+
+class ReplayStats(namedtuple("ReplayStats", "game commands checkpoints seconds")):
+    """Outcome of a replay: the replayed game, the number of commands
+    and checkpoints replayed, and the time it took."""
+    pass
+
+def state_hash(game: Game) -> bytes:
+    """Hashes the state of a game: everything that is saved, but messages."""
+    return sha1(savegame.dumps(game, messages=False)).digest()
+
+class CommandLog():
+    """Records the commands of a game."""
+
+    CHECKPOINT_EVERY = 500
+    """Number of commands between two checkpoints."""
+
+    def __init__(self, seed: int, levels_seed: int):
+        self.data = bytearray(_HEADER.pack(MAGIC, VERSION, seed, levels_seed))
+        """The encoded log."""
+        self.commands = 0
+        """Number of commands recorded."""
+
+    @classmethod
+    def start(cls, game: Game) -> 'CommandLog':
+        """Starts recording a new game. Call this before sending any command."""
+        log = cls(game.seed, game.level_supply.rng.initial_seed)
+        game.log = log
+        return log
+
+    def record(self, game: Game, cmd: Command) -> None:
+        """Appends `cmd`, which `game` is about to run."""
+        if not cmd.logged:
+            return
+        if self.commands and self.commands % self.CHECKPOINT_EVERY == 0:
+            self.checkpoint(game)
+        self.data.append(cmd.registry_id)
+        for value in (cmd if isinstance(cmd, tuple) else ()):
+            self._encode(game, value)
+        self.commands += 1
+
+    def checkpoint(self, game: Game) -> None:
+        """Appends a hash of the current state of `game`."""
+        self.data.append(_CHECKPOINT)
+        self.data += state_hash(game)
+
+    def save(self, path: str, game: Optional[Game] = None) -> None:
+        """Writes the log to `path`.
+
+        :param game: if given, a final checkpoint of its state is added."""
+        if game is not None:
+            self.checkpoint(game)
+        with open(path, "wb") as f:
+            f.write(self.data)
+
+    def _encode(self, game: Game, value) -> None:
+        data = self.data
+        if value is None:
+            data.append(_Tag.NONE)
+        elif isinstance(value, Direction):
+            data += bytes((_Tag.DIRECTION, _DIRECTIONS.index(value)))
+        elif isinstance(value, Item):
+            slot = game.player.inventory.slot(value)
+            if slot is None:
+                raise ValueError("Can't record an item outside the player's inventory")
+            data += bytes((_Tag.SLOT, ord(slot)))
+        elif isinstance(value, type) and issubclass(value, Command):
+            data.append(_Tag.COMMAND_TYPE)
+            data += struct.pack("<H", value.registry_id)
+        elif isinstance(value, type) and issubclass(value, Item):
+            data.append(_Tag.ITEM_TYPE)
+            data += struct.pack("<H", value.registry_id)
+        elif isinstance(value, str):
+            encoded = value.encode("utf-8")
+            data.append(_Tag.STRING)
+            data += struct.pack("<I", len(encoded)) + encoded
+        elif isinstance(value, int):
+            data.append(_Tag.INT)
+            data += struct.pack("<q", value)
+        elif isinstance(value, tuple):
+            data.append(_Tag.TUPLE)
+            data += struct.pack("<H", len(value))
+            for v in value:
+                self._encode(game, v)
+        elif value is game.player:
+            data.append(_Tag.PLAYER)
+        else:
+            raise ValueError("Can't record {!r}".format(value))
+
+class _LogReader():
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = _HEADER.size
+        self.commands = 0
+        """Number of commands read so far."""
+
+    def records(self, game: Game) -> Iterator[Union[Command, bytes]]:
+        """Yields the commands of the log, and the digests of its checkpoints."""
+        data = self.data
+        while self.offset < len(data):
+            opcode = data[self.offset]
+            self.offset += 1
+            if opcode == _CHECKPOINT:
+                self.offset += 20
+                yield data[self.offset - 20:self.offset]
+            else:
+                cls = Command.registry.get(opcode)
+                if cls is None:
+                    raise ReplayError("Unknown command id {} after {} commands".format(opcode, self.commands))
+                fields = getattr(cls, "_fields", ())
+                yield cls(*(self._decode(game) for __ in fields))
+                self.commands += 1
+
+    def _decode(self, game: Game):
+        data = self.data
+        tag = data[self.offset]
+        self.offset += 1
+        if tag == _Tag.NONE:
+            return None
+        elif tag == _Tag.DIRECTION:
+            self.offset += 1
+            return _DIRECTIONS[data[self.offset - 1]]
+        elif tag == _Tag.SLOT:
+            self.offset += 1
+            try:
+                return game.player.inventory[chr(data[self.offset - 1])]
+            except KeyError:
+                raise ReplayError("No item in slot {} after {} commands".format(
+                    chr(data[self.offset - 1]), self.commands)) from None
+        elif tag in (_Tag.COMMAND_TYPE, _Tag.ITEM_TYPE):
+            registry_id, = struct.unpack_from("<H", data, self.offset)
+            self.offset += 2
+            cls = (Command if tag == _Tag.COMMAND_TYPE else Item).registry.get(registry_id)
+            if cls is None:
+                raise ReplayError("Unknown type id {} after {} commands".format(registry_id, self.commands))
+            return cls
+        elif tag == _Tag.STRING:
+            size, = struct.unpack_from("<I", data, self.offset)
+            self.offset += 4 + size
+            return bytes(data[self.offset - size:self.offset]).decode("utf-8")
+        elif tag == _Tag.INT:
+            self.offset += 8
+            return struct.unpack_from("<q", data, self.offset - 8)[0]
+        elif tag == _Tag.TUPLE:
+            size, = struct.unpack_from("<H", data, self.offset)
+            self.offset += 2
+            return tuple(self._decode(game) for __ in range(size))
+        elif tag == _Tag.PLAYER:
+            return game.player
+        raise ReplayError("Unknown tag {} at offset {}".format(tag, self.offset - 1))
+
+def replay(data: bytes, description_factory=None, check: bool = True) -> ReplayStats:
+    """Replays a command log headlessly.
+
+    :param description_factory: defaults to EnglishDescriptionFactory.
+    :param check: compare the game's state against the log's checkpoints.
+        Raises ReplayError on the first mismatch."""
+    magic, version, seed, levels_seed = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ReplayError("Not a command log")
+    if version != VERSION:
+        raise ReplayError("Unsupported command log version {} (expected {})".format(version, VERSION))
+    start = perf_counter()
+    game = Game(description_factory or EnglishDescriptionFactory(), seed, LevelSupply(levels_seed, workers=0))
+    commands = checkpoints = 0
+    for record in _LogReader(data).records(game):
+        if isinstance(record, Command):
+            game.add_command(record)
+            game.messages.clear()
+            commands += 1
+        elif check:
+            if state_hash(game) != record:
+                raise ReplayError("State differs from the recording after {} commands".format(commands))
+            checkpoints += 1
+    return ReplayStats(game, commands, checkpoints, perf_counter() - start)
+
+def replay_file(path: str, description_factory=None, check: bool = True) -> ReplayStats:
+    """Replays the command log at `path`."""
+    with open(path, "rb") as f:
+        return replay(f.read(), description_factory, check)
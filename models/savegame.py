@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""Binary save files.
+
+A save file starts with a header and a table of contents, followed
+by the game section and one section per level:
+
+    header      magic, format version, number of levels
+    contents    (offset, size) of the game section and of each level
+    game        seeds, RNG state, player, inventory, item names, messages
+    level...    rooms, packed per-cell arrays, items
+
+Cells are stored in row-major order, in arrays of `Position.SCREEN_W *
+Position.SCREEN_H` elements: square type, owning feature and lighting
+flags. Items are stored by their `Item.registry_id`.
+
+Levels are decoded lazily: `load` memory-maps the file and only decodes
+a level the first time the game accesses it. `encode_level` and
+`decode_level` are also used by `LevelList` to page levels out to disk.
+"""
+import struct
+from mmap import mmap, ACCESS_READ
+from typing import Optional
+
+from models.game import Game, LevelList, LevelSupply
+from models.items import Item, Beatitude
+from models.level import Level, Room, Square, SquareStore, SquareType
+from models.player import Player, Health
+from models.position import Position, at, position
+from models.visibility import from_bytes, to_bytes
+from helpers.skills import Inventory
+
+MAGIC = b"JGRS"
+VERSION = 3
+"""Version of the format. Files with another version are rejected."""
+
+_HEADER = struct.Struct("<4sHH")
+_ENTRY = struct.Struct("<QI")
+_CELLS = Position.SCREEN_W * Position.SCREEN_H
+_NO_SQUARE = 255
+_KNOWN, _LIT = 1, 2
+_KNOWN_CELLS = bytes(i & _KNOWN and 1 for i in range(256))
+_LIT_CELLS = bytes(i & _LIT and 1 for i in range(256))
+"""Translation tables from cell flags to the bytes of `to_bytes`."""
+_BEATITUDES = [None] + list(Beatitude)
+_RNG_STATE = 625
+
+class SaveFormatError(Exception):
+    """The file is not a save file, or has an unsupported version."""
+    pass
+
+def _item_class(registry_id: int) -> type:
+    """Returns the item class with `registry_id`."""
+    try:
+        return Item.registry[registry_id]
+    except KeyError:
+        raise SaveFormatError("Unknown item id {}".format(registry_id)) from None
+
+class _Writer():
+    """Little-endian binary writer."""
+    def __init__(self):
+        self.data = bytearray()
+
+    def pack(self, fmt: str, *values) -> None:
+        self.data += struct.pack("<" + fmt, *values)
+
+    def string(self, s: str) -> None:
+        encoded = s.encode("utf-8")
+        self.pack("I", len(encoded))
+        self.data += encoded
+
+    def item(self, item: Item) -> None:
+        flags = _BEATITUDES.index(item.beatitude) | (item.beatitude_known << 7)
+        self.pack("HB", item.registry_id, flags)
+
+class _Reader():
+    """Little-endian binary reader over a buffer."""
+    def __init__(self, buffer, offset: int = 0):
+        self.buffer = buffer
+        self.offset = offset
+
+    def unpack(self, fmt: str) -> tuple:
+        fmt = struct.Struct("<" + fmt)
+        values = fmt.unpack_from(self.buffer, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def string(self) -> str:
+        size, = self.unpack("I")
+        self.offset += size
+        return bytes(self.buffer[self.offset - size:self.offset]).decode("utf-8")
+
+    def item(self) -> Item:
+        registry_id, flags = self.unpack("HB")
+        item = _item_class(registry_id)()
+        beatitude = _BEATITUDES[flags & 0x7F]
+        if beatitude is not None:
+            item.beatitude = beatitude
+        if flags & 0x80:
+            item.beatitude_known = True
+        return item
+
+def encode_level(level: Level) -> bytes:
+    """Encodes a level."""
+    out = _Writer()
+    out.pack("H", len(level.rooms))
+    for room in level.rooms:
+        out.pack("BBBBB", room.top_left.col, room.top_left.row, room.width, room.height, room.lit)
+    out.pack("H", len(level.corridors))
+    features = {id(feature): i for i, feature in enumerate(level.features)}
+    types, owners = bytearray([_NO_SQUARE]) * _CELLS, [0] * _CELLS
+    for offset, entry in enumerate(level._grid):
+        if entry is not None:
+            feature, square = entry
+            types[offset] = square.type.value
+            owners[offset] = features[id(feature)]
+    out.data += types
+    out.pack("{}H".format(_CELLS), *owners)
+    # Cells hold 0 or 1, so the layers can be combined as ints
+    known, lit = to_bytes(level.visibility.known), to_bytes(level.visibility.lit)
+    out.data += (int.from_bytes(known, "little") * _KNOWN | int.from_bytes(lit, "little") * _LIT).to_bytes(_CELLS, "little")
+    items = [(pos.offset, item) for pos, stack in level.items.all() for item in stack]
+    out.pack("I", len(items))
+    for offset, item in items:
+        out.pack("H", offset)
+        out.item(item)
+    return bytes(out.data)
+
+def decode_level(buffer) -> Level:
+    """Decodes a level encoded by `encode_level`."""
+    data = _Reader(buffer)
+    rooms = []
+    for __ in range(data.unpack("H")[0]):
+        col, row, width, height, lit = data.unpack("BBBBB")
+        room = Room(position(col, row), width, height)
+        room.lit = bool(lit)
+        rooms.append(room)
+    corridors = [SquareStore() for __ in range(data.unpack("H")[0])]
+    features = rooms + corridors
+    types = data.buffer[data.offset:data.offset + _CELLS]
+    data.offset += _CELLS
+    owners = data.unpack("{}H".format(_CELLS))
+    flags = data.buffer[data.offset:data.offset + _CELLS]
+    data.offset += _CELLS
+    owned = [set() for __ in features]
+    for offset in range(_CELLS):
+        if types[offset] != _NO_SQUARE:
+            pos = at(offset)
+            feature = features[owners[offset]]
+            owned[owners[offset]].add(pos)
+            if pos not in feature:
+                feature[pos] = Square(SquareType(types[offset]))
+    for room, positions in zip(rooms, owned):
+        for pos in set(room) - positions:
+            del room[pos]   # Doorways
+    level = Level(rooms, corridors)
+    flags = bytes(flags)
+    level.visibility.known = from_bytes(flags.translate(_KNOWN_CELLS))
+    level.visibility.lit = from_bytes(flags.translate(_LIT_CELLS))
+    for __ in range(data.unpack("I")[0]):
+        offset, = data.unpack("H")
+        level.items.add(at(offset), data.item())
+    return level
+
+def _encode_game(game: Game, messages: bool) -> bytes:
+    out = _Writer()
+    player = game.player
+    version, state, gauss = game.rng.getstate()
+    out.pack("QQ", game.seed, game.level_supply.rng.initial_seed)
+    out.pack("B{}Id".format(_RNG_STATE), version, *state, gauss if gauss is not None else float("nan"))
+    out.pack("IH", game.turn, game.depth)
+    scheduler = game.scheduler
+    out.pack("QIii", scheduler.time, scheduler.when(player) - scheduler.time, player.speed, player.energy)
+    out.string(player.name)
+    out.pack("BBii", player.pos.col, player.pos.row, player.health.current_hp, player.health.max_hp)
+    out.pack("H", len(player.inventory))
+    for slot in player.inventory:
+        stack = player.inventory.stack(slot)
+        out.string(slot)
+        out.pack("H", len(stack))
+        for item in reversed(stack):
+            out.item(item)
+    descriptions = game.descriptions
+    out.pack("H", len(descriptions.unknown_items))
+    for cls, name in descriptions.unknown_items.items():
+        out.pack("H", cls.registry_id)
+        out.string(name)
+    out.pack("H", len(descriptions.known_items))
+    for cls in sorted(descriptions.known_items, key=lambda cls: cls.registry_id):
+        out.pack("H", cls.registry_id)
+    messages = [msg for msg in game.messages if isinstance(msg, str)] if messages else []
+    out.pack("H", len(messages))
+    for msg in messages:
+        out.string(msg)
+    return bytes(out.data)
+
+def dumps(game: Game, messages: bool = True) -> bytes:
+    """Encodes a game.
+
+    :param messages: keep the pending text messages. Popups and
+        queries are never kept."""
+    sections = [_encode_game(game, messages)] + [game.levels.encoded(depth) for depth in range(len(game.levels))]
+    out = _Writer()
+    out.pack("4sHH", MAGIC, VERSION, len(sections) - 1)
+    offset = _HEADER.size + _ENTRY.size * len(sections)
+    for section in sections:
+        out.pack("QI", offset, len(section))
+        offset += len(section)
+    for section in sections:
+        out.data += section
+    return bytes(out.data)
+
+def save(game: Game, path: str) -> None:
+    """Saves a game to `path`."""
+    with open(path, "wb") as f:
+        f.write(dumps(game))
+
+def loads(buffer, description_factory, level_supply: Optional[LevelSupply] = None,
+          levels: Optional[LevelList] = None) -> Game:
+    """Decodes a game. Levels are decoded when first accessed.
+
+    :param buffer: any object supporting the buffer protocol; it must
+        stay valid as long as some levels are not loaded.
+    :param description_factory: factory to restore item names into.
+    :param levels: an empty LevelList to load the levels into."""
+    magic, version, num_levels = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise SaveFormatError("Not a save file")
+    if version != VERSION:
+        raise SaveFormatError("Unsupported save file version {} (expected {})".format(version, VERSION))
+    sections = [_ENTRY.unpack_from(buffer, _HEADER.size + _ENTRY.size * i) for i in range(num_levels + 1)]
+    view = memoryview(buffer)
+    if levels is None:
+        levels = LevelList()
+    for offset, size in sections[1:]:
+        levels.append(view[offset:offset + size])
+    offset, size = sections[0]
+    data = _Reader(view[offset:offset + size])
+
+    seed, levels_seed = data.unpack("QQ")
+    rng_version, *state = data.unpack("B{}Id".format(_RNG_STATE))
+    gauss = state.pop()
+    turn, depth = data.unpack("IH")
+    time, delay, speed, energy = data.unpack("QIii")
+    name = data.string()
+    col, row, current_hp, max_hp = data.unpack("BBii")
+    player = Player(levels[depth], position(col, row), name)
+    player.health = Health(player, max_hp)
+    player.health.current_hp = current_hp
+    player.speed, player.energy = speed, energy
+    player.inventory = Inventory()
+    for __ in range(data.unpack("H")[0]):
+        slot = data.string()
+        for __ in range(data.unpack("H")[0]):
+            player.inventory.add(data.item(), slot)
+    player.resume_lights()
+
+    game = Game.restore(description_factory, seed, levels, player,
+                        level_supply or LevelSupply(levels_seed))
+    game.rng.setstate((rng_version, tuple(state), None if gauss != gauss else gauss))
+    game.turn = turn
+    game.scheduler.time = time
+    game.scheduler.add(player, delay)
+    descriptions = game.descriptions
+    pairing = {}
+    for __ in range(data.unpack("H")[0]):
+        registry_id, = data.unpack("H")
+        pairing[_item_class(registry_id)] = data.string()
+    descriptions.unknown_items = pairing
+    descriptions.known_items.clear()
+    for __ in range(data.unpack("H")[0]):
+        descriptions.known_items.add(_item_class(data.unpack("H")[0]))
+    for __ in range(data.unpack("H")[0]):
+        game.messages.append(data.string())
+    return game
+
+def load(path: str, description_factory, level_supply: Optional[LevelSupply] = None,
+         levels: Optional[LevelList] = None) -> Game:
+    """Loads a game from `path`.
+
+    The file is memory-mapped, and levels are only decoded when the
+    game first accesses them."""
+    with open(path, "rb") as f:
+        buffer = mmap(f.fileno(), 0, access=ACCESS_READ)
+    return loads(buffer, description_factory, level_supply, levels)
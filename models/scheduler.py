@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Turn scheduler.
+
+Every creature has a speed and an energy. A creature gains `speed`
+energy per tick, may act as long as its energy is not negative, and
+pays for each action with energy: `ACTION_COST` for a normal one. At
+the default speed (`Creature.SPEED`, equal to `ACTION_COST`) creatures
+act once per tick; at twice that speed, twice per tick.
+
+Creatures wait in a heap keyed by the tick of their next action, so
+scheduling an action costs O(log n) in the number of creatures.
+"""
+from heapq import heapify, heappop, heappush
+from itertools import count
+from typing import Optional
+
+ACTION_COST = 12
+"""Energy spent by a normal action."""
+
+class Scheduler():
+    """Decides which creature acts next.
+
+    Creatures can be added and removed at any time, even by a creature
+    that is acting. Removed creatures are left in the heap, marked as
+    such, and skipped when they reach the top."""
+
+    def __init__(self):
+        self.time = 0
+        """Tick of the action being run, or of the last one."""
+        self._heap = []
+        """Entries [tick, sequence number, creature or None], a min-heap."""
+        self._entries = {}
+        """id(creature)->heap entry, for the scheduled creatures."""
+        self._sequence = count()
+        self._removed = 0
+        """Number of removed entries still in the heap."""
+        self._acting = None
+        """The creature whose `act` is running."""
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, creature: 'Creature') -> bool:
+        return id(creature) in self._entries
+
+    def when(self, creature: 'Creature') -> int:
+        """Returns the tick of the next action of `creature`, which must be scheduled."""
+        return self._entries[id(creature)][0]
+
+    def add(self, creature: 'Creature', delay: int = 0) -> None:
+        """Schedules the next action of `creature` in `delay` ticks."""
+        if id(creature) in self._entries:
+            raise ValueError("{!r} is already scheduled".format(creature))
+        entry = [self.time + delay, next(self._sequence), creature]
+        self._entries[id(creature)] = entry
+        heappush(self._heap, entry)
+
+    def remove(self, creature: 'Creature') -> None:
+        """Unschedules `creature`, if it is scheduled or acting."""
+        if creature is self._acting:
+            self._acting = None
+        entry = self._entries.pop(id(creature), None)
+        if entry is None:
+            return
+        entry[2] = None
+        self._removed += 1
+        if self._removed > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if entry[2] is not None]
+            heapify(self._heap)
+            self._removed = 0
+
+    def peek(self) -> Optional['Creature']:
+        """Returns the creature that acts next, or None if there are none."""
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heappop(heap)
+            self._removed -= 1
+        return heap[0][2] if heap else None
+
+    def pop(self) -> 'Creature':
+        """Unschedules the creature that acts next, and moves the clock to its tick."""
+        if self.peek() is None:
+            raise IndexError("No creature is scheduled")
+        time, __, creature = heappop(self._heap)
+        del self._entries[id(creature)]
+        self.time = time
+        return creature
+
+    def spend(self, creature: 'Creature', cost: int = ACTION_COST) -> None:
+        """Charges `creature` for an action and schedules its next one."""
+        if cost <= 0:
+            raise ValueError("Actions must cost some energy")
+        creature.energy -= cost
+        wait = 0
+        if creature.energy < 0:
+            wait = (creature.speed - 1 - creature.energy) // creature.speed    # ceil(-energy / speed)
+        creature.energy += wait * creature.speed
+        self.add(creature, wait)
+
+    def run(self, game: 'Game', stop: Optional['Creature'] = None, until: Optional[int] = None) -> int:
+        """Lets creatures act, by calling their `act` method, in order.
+
+        :param stop: return when this creature is next (e.g. the player,
+            whose actions come from the user).
+        :param until: return before running actions at this tick.
+        Returns the number of actions run."""
+        actions = 0
+        while True:
+            creature = self.peek()
+            if creature is None or creature is stop or (until is not None and self._heap[0][0] >= until):
+                break
+            self.pop()
+            self._acting = creature
+            cost = creature.act(game)
+            if self._acting is creature:
+                self.spend(creature, cost)
+            self._acting = None
+            actions += 1
+        return actions
+
+    def play(self, game: 'Game', creature: 'Creature', cost: int = ACTION_COST) -> int:
+        """Charges `creature` for an action it took outside the scheduler
+        (e.g. the player's), then runs the other creatures until its next
+        turn. Returns the number of actions run."""
+        self.run(game, stop=creature)
+        if self.peek() is not creature:
+            raise ValueError("{!r} is not scheduled".format(creature))
+        self.pop()
+        self.spend(creature, cost)
+        return self.run(game, stop=creature)
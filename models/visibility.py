@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Visibility layer.
+
+The known and lit flags of the squares of a level are kept in bitsets:
+Python ints whose bit i is the flag of the square at row-major offset i
+of the level's grid. Squares read and write their flags through the
+layer, whole features are switched on or off with a single bitwise
+operation, and finding what changed between two states is a mask
+operation.
+"""
+from typing import Iterator, List, Tuple
+
+from models.position import Position, neighbor_offsets
+
+_CELLS = Position.SCREEN_W * Position.SCREEN_H
+_TO_BYTES = bytes.maketrans(b"01", b"\x00\x01")
+_FROM_BYTES = bytes.maketrans(b"\x00\x01", b"01")
+
+class Visibility():
+    """Known and lit flags of the squares of a level."""
+
+    def __init__(self, level: 'Level'):
+        self.level = level
+        self.known = 0
+        """Squares shown on the map."""
+        self.lit = 0
+        """Squares lit by the player's light (see `Square._lit`)."""
+        self._opaque = 0
+        self._version = None
+
+    def attach(self, offset: int, square: 'Square') -> None:
+        """Moves the flags of `square` into the layer, at `offset`, whose
+        bits must be clear (see `detach`)."""
+        if square._layer is self:
+            return
+        if square._own_known:
+            self.known |= 1 << offset
+        if square._own_lit:
+            self.lit |= 1 << offset
+        square._layer, square._offset = self, offset
+
+    def detach(self, offset: int, square: 'Square') -> None:
+        """Moves the flags of `square`, at `offset`, back into the square,
+        and clears them in the layer."""
+        if square._layer is not self:
+            return
+        square._own_known = bool(self.known >> offset & 1)
+        square._own_lit = bool(self.lit >> offset & 1)
+        square._layer = None
+        mask = ~(1 << offset)
+        self.known &= mask
+        self.lit &= mask
+
+    def switch(self, mask: int, switch: bool) -> None:
+        """Turns the light on/off on the squares in `mask`."""
+        self.lit = self.lit | mask if switch else self.lit & ~mask
+
+    def discover(self, mask: int) -> None:
+        """Marks the squares in `mask` as known."""
+        self.known |= mask
+
+    def opaque(self) -> int:
+        """Returns the squares that are not walkable: they look lit once known."""
+        if self._version != self.level.version:
+            grid = self.level._grid
+            self._opaque = from_bytes(bytes(entry is not None and not entry[1].is_walkable for entry in grid))
+            self._version = self.level.version
+        return self._opaque
+
+    def shown_lit(self) -> int:
+        """Returns the squares drawn as lit (see `Square.lit`)."""
+        return self.lit | (self.known & self.opaque())
+
+    def snapshot(self) -> Tuple[int, int]:
+        """Returns the state of the layer, as drawn, for `changed`."""
+        return self.known, self.shown_lit()
+
+    def changed(self, snapshot: Tuple[int, int]) -> int:
+        """Returns the known squares that look different since `snapshot`."""
+        known, lit = snapshot
+        return self.known & ((self.known ^ known) | (self.shown_lit() ^ lit))
+
+def offsets(bits: int) -> Iterator[int]:
+    """Yields the offsets of the bits set in `bits`, in increasing order."""
+    digits = format(bits, "b")[::-1]
+    offset = digits.find("1")
+    while offset >= 0:
+        yield offset
+        offset = digits.find("1", offset + 1)
+
+def to_bytes(bits: int) -> bytes:
+    """Returns one byte per grid cell, 1 where `bits` is set and 0 elsewhere."""
+    return format(bits, "0{}b".format(_CELLS)).encode("ascii")[::-1].translate(_TO_BYTES)
+
+def from_bytes(cells: bytes) -> int:
+    """Returns the bitset of the non-zero bytes of `cells`, which must be 0 or 1."""
+    return int(bytes(cells)[::-1].translate(_FROM_BYTES) or b"0", 2)
+
+_NEIGHBORHOODS = [None] * _CELLS    # type: List[int]
+
+def neighborhood(offset: int) -> int:
+    """Returns the bitset of the cell at `offset` and its 8 neighbors."""
+    mask = _NEIGHBORHOODS[offset]
+    if mask is None:
+        mask = 1 << offset
+        for n in neighbor_offsets(True)[offset]:
+            mask |= 1 << n
+        _NEIGHBORHOODS[offset] = mask
+    return mask
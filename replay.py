@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Replays a command log recorded with `roguelike.py --record`.
+
+Example: python replay.py session.log --profile replay.prof
+"""
+import argparse
+import cProfile
+
+from models.replay import ReplayError, replay_file
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", help="command log")
+    parser.add_argument("--no-check", action="store_true", help="don't compare the game's state at checkpoints")
+    parser.add_argument("--profile", metavar="PATH", help="run under cProfile and dump the stats to PATH")
+    args = parser.parse_args()
+
+    profiler = cProfile.Profile() if args.profile else None
+    try:
+        if profiler:
+            stats = profiler.runcall(replay_file, args.log, check=not args.no_check)
+            profiler.dump_stats(args.profile)
+        else:
+            stats = replay_file(args.log, check=not args.no_check)
+    except ReplayError as exc:
+        parser.exit(1, "replay failed: {}\n".format(exc))
+    print("commands:          {}".format(stats.commands))
+    print("checkpoints:       {}".format(stats.checkpoints))
+    print("levels:            {}".format(len(stats.game.levels)))
+    print("time:              {:.2f} s".format(stats.seconds))
+    print("commands/s:        {:.0f}".format(stats.commands / stats.seconds))
+
+if __name__ == '__main__':
+    main()
@@ -5,15 +5,72 @@ This module contains some RNGs suitable for a roguelike game.
 They simulate dice tosses, coin flips, etc.
 """
 
-from random import randint, getrandbits
+from hashlib import sha256
+from os import urandom
+from random import Random
+from typing import Hashable, Optional
 
 from helpers.validation import validate
 
+class Rng(Random):
+    """A seedable random stream.
 
-#@validate({
-#    0: {'type': 'integer', 'min': 1},
-#    1: {'type': 'integer', 'min': 2}
-#})
+    An Rng can be split into independent child streams, e.g. one per
+    subsystem. A child's seed only depends on its parent's seed and on
+    the child's key, so the whole tree of streams can be reproduced from
+    one seed no matter the order (or the process) in which they are used.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        if seed is None:
+            seed = int.from_bytes(urandom(8), "big")
+        self.initial_seed = seed
+        """The seed this stream was created with."""
+        self._numpy = None
+        super().__init__(seed)
+
+    def __reduce__(self):
+        # Random.__reduce__ would drop initial_seed
+        return self.__class__, (self.initial_seed,), self.getstate()
+
+    def split(self, key: Hashable) -> 'Rng':
+        """Returns the child stream identified by `key`.
+
+        Splitting twice with the same key returns equivalent streams."""
+        digest = sha256("{}/{!r}".format(self.initial_seed, key).encode()).digest()
+        return Rng(int.from_bytes(digest[:8], "big"))
+
+    def d(self, num: int, max_val: int) -> int:   #pylint: disable=invalid-name
+        """Rolls `num` dice with `max_val` sides each. See `rnd.dice.d`."""
+        random = self.random
+        total = num
+        for __ in range(num):
+            total += int(random() * max_val)
+        return total
+
+    def coin(self) -> bool:
+        """A coin toss, expressed as boolean."""
+        return bool(self.getrandbits(1))
+
+    def roll_many(self, num: int, max_val: int, count: int) -> 'numpy.ndarray':
+        """Returns an array of `count` results of `num`d`max_val` rolls.
+
+        Rolls are drawn from a NumPy generator seeded from this stream,
+        so they don't consume numbers from the stream itself."""
+        if self._numpy is None:
+            # NumPy is only needed for batched rolls
+            from numpy.random import RandomState
+            seed = self.split("numpy").initial_seed
+            self._numpy = RandomState([seed & 0xFFFFFFFF, seed >> 32])
+        return self._numpy.randint(1, max_val + 1, size=(count, num)).sum(axis=1)
+
+global_rng = Rng()
+"""Stream used when no other Rng is given."""
+
+@validate({
+    0: {'type': 'integer', 'min': 1},
+    1: {'type': 'integer', 'min': 2}
+})
 def d(num: int, max_val: int) -> int:   #pylint: disable=invalid-name
     """Random number such that num <= d(n,x) <= num*x.
 
@@ -25,8 +82,8 @@ def d(num: int, max_val: int) -> int:   #pylint: disable=invalid-name
 
     .. seealso:: https://en.wikipedia.org/wiki/Dice_notation
     """
-    return sum(randint(1, max_val) for __ in range(num))
+    return global_rng.d(num, max_val)
 
 def coin() -> bool:
     """A coin toss, expressed as boolean."""
-    return bool(getrandbits(1))
+    return global_rng.coin()
@@ -1,15 +1,36 @@
 # -*- coding: utf-8 -*-
-from asciimatics.screen import Screen
-from asciimatics.event import KeyboardEvent
+import argparse
 
-from models.level import Level, Room, SquareType, Square
-from models.game import Game
-from ui.text_interface import TextInterface
-from helpers.i18n import EnglishDescriptionFactory
+# Game modules are imported once the arguments are parsed, so that
+# --help and --import-report don't pay for them
+GAME_MODULES = "import models.game, models.replay, ui.text_interface, helpers.i18n"
+"""Imports made before the first frame."""
 
 if __name__ == '__main__':
-    game = Game(EnglishDescriptionFactory())
+    parser = argparse.ArgumentParser(description="Plays the game.")
+    parser.add_argument("--seed", type=int, default=None, help="dungeon seed (default: random)")
+    parser.add_argument("--record", metavar="PATH", help="record the session's commands to PATH, for replay.py")
+    parser.add_argument("--import-report", action="store_true", help="print the slowest imports of the game's modules and exit")
+    args = parser.parse_args()
+
+    if args.import_report:
+        from helpers.profiling import import_report
+        print("\n".join(import_report(GAME_MODULES)))
+        raise SystemExit
+
+    from models.game import Game
+    from models.replay import CommandLog
+    from ui.text_interface import TextInterface
+    from helpers.i18n import EnglishDescriptionFactory
+
+    # No key descends yet, so prefetching levels in a worker would only slow down startup
+    game = Game(EnglishDescriptionFactory(), args.seed)
+    log = CommandLog.start(game) if args.record else None
     try:
         interface = TextInterface(game)
     except KeyboardInterrupt:
         print("\nGoodbye & thanks for playing!")
+    finally:
+        if log is not None:
+            log.save(args.record, game)
+        game.close()
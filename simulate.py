@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Runs headless games in parallel and reports the game's throughput.
+
+Example: python simulate.py --games 1000 --turns 500
+"""
+import argparse
+from time import perf_counter
+
+from models.game import LevelList
+from ui.headless import run_batch
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=100, help="number of games")
+    parser.add_argument("--turns", type=int, default=1000, help="maximum turns per game")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--script", type=argparse.FileType("r"), help="file with the keys to press (default: random keys)")
+    parser.add_argument("--descend-every", type=int, default=0, metavar="N", help="with random keys, descend about once every N turns")
+    parser.add_argument("--stop-on-death", action="store_true", help="end a game when the player dies")
+    parser.add_argument("--resident-levels", type=int, default=None, metavar="N",
+                        help="levels kept in memory per game, 0 for all (default: {})".format(LevelList.MAX_RESIDENT))
+    args = parser.parse_args()
+
+    script = args.script.read().replace("\n", "") if args.script else None
+    start = perf_counter()
+    results = run_batch(args.games, args.turns, args.seed, args.workers, script, args.descend_every, args.stop_on_death,
+                        args.resident_levels)
+    wall = perf_counter() - start
+
+    timed = results[1:] or results     # The first game traces memory
+    turns = sum(r.turns for r in timed)
+    levels = sum(r.levels for r in timed)
+    cpu = sum(r.seconds for r in timed)
+    print("games:             {}".format(len(results)))
+    print("wall time:         {:.2f} s".format(wall))
+    print("turns/s (core):    {:.0f}".format(turns / cpu))
+    print("turns/s (total):   {:.0f}".format(sum(r.turns for r in results) / wall))
+    print("levels/s (core):   {:.1f}".format(levels / cpu))
+    print("levels/s (total):  {:.1f}".format(sum(r.levels for r in results) / wall))
+    print("memory per game:   {:.1f} KiB".format(results[0].memory / 1024))
+    print("levels evicted:    {}".format(sum(r.evictions for r in results)))
+    print("levels reloaded:   {}".format(sum(r.reloads for r in results)))
+
+if __name__ == '__main__':
+    main()
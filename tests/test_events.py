@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""The event bus only collects events that someone listens to."""
+from models.events import EventBus, ItemIdentified, Moved
+
+class Listener():
+    def __init__(self):
+        self.events = []
+    def on_event(self, event):
+        self.events.append(event)
+
+def test_unsubscribe_bound_method():
+    bus, listener = EventBus(), Listener()
+    bus.subscribe(ItemIdentified, listener.on_event)
+    bus.unsubscribe(ItemIdentified, listener.on_event)
+    bus.publish(ItemIdentified(int))
+    bus.flush(1)
+    assert listener.events == []
+
+def test_no_pending_events_without_listeners():
+    bus, listener = EventBus(), Listener()
+    bus.subscribe(Moved, listener.on_event)
+    bus.subscribe(ItemIdentified, listener.on_event)
+    bus.unsubscribe(Moved, listener.on_event)
+    bus.unsubscribe(ItemIdentified, listener.on_event)
+    assert not bus._listeners
+    bus.publish(ItemIdentified(int))
+    assert bus._pending == []
+
+def test_other_listeners_stay():
+    bus, first, second = EventBus(), Listener(), Listener()
+    bus.subscribe(ItemIdentified, first.on_event)
+    bus.subscribe(ItemIdentified, second.on_event)
+    bus.unsubscribe(ItemIdentified, first.on_event)
+    bus.publish(ItemIdentified(int))
+    bus.flush(1)
+    assert first.events == [] and len(second.events) == 1
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Cached descriptions follow the factory's state."""
+from helpers.i18n import EnglishDescriptionFactory, KnownItems
+from helpers.skills import Inventory
+from models.items import HealingPotion, HealingScroll
+from rnd.dice import Rng
+
+def test_version_is_unique():
+    factory = EnglishDescriptionFactory(Rng(0))
+    seen = {factory.version}
+    factory.known_items.add(HealingPotion)
+    seen.add(factory.version)
+    # Going back to no known items with a fresh set must not reuse a version
+    factory.known_items = KnownItems()
+    seen.add(factory.version)
+    factory.shuffle(Rng(1))
+    seen.add(factory.version)
+    factory.known_items.add(HealingScroll)
+    seen.add(factory.version)
+    assert len(seen) == 5
+
+def test_view_follows_identification():
+    factory = EnglishDescriptionFactory(Rng(0))
+    inventory = Inventory()
+    inventory.add(HealingPotion())
+    before = inventory.get_view(factory.describe)
+    factory.known_items = KnownItems([HealingPotion])
+    after = inventory.get_view(factory.describe)
+    assert before != after
+    assert list(after) == ["a - " + factory.describe(HealingPotion())]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Inventory stacks follow the stack key of their items."""
+from helpers.skills import Inventory
+from models.items import Beatitude, HealingPotion
+
+def _potion(beatitude=None, known=False) -> HealingPotion:
+    potion = HealingPotion()
+    potion.beatitude, potion.beatitude_known = beatitude, known
+    return potion
+
+def test_restack_alone_keeps_its_slot():
+    inventory = Inventory()
+    potion = _potion(Beatitude.CURSED)
+    slot = inventory.add(potion)
+    potion.beatitude_known = True
+    assert inventory.restack(potion) == slot
+    # Unidentified potions no longer stack with it
+    assert inventory.add(_potion(Beatitude.CURSED)) != slot
+    assert inventory.add(_potion(Beatitude.CURSED, True)) == slot
+
+def test_restack_joins_identified_stack():
+    inventory = Inventory()
+    known = inventory.add(_potion(Beatitude.CURSED, True))
+    potion = _potion(Beatitude.CURSED)
+    unknown = inventory.add(potion)
+    inventory.add(_potion(Beatitude.CURSED))
+    potion.beatitude_known = True
+    assert inventory.restack(potion) == known
+    assert inventory.count(known) == 2
+    assert inventory.count(unknown) == 1
+    assert inventory.add(_potion(Beatitude.CURSED)) == unknown
+
+def test_remove_after_key_change():
+    inventory = Inventory()
+    potion = _potion(Beatitude.CURSED)
+    inventory.add(potion)
+    potion.beatitude_known = True
+    inventory.remove(potion)
+    assert len(inventory) == 0
+    assert inventory.add(_potion(Beatitude.CURSED)) == "a"
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""The item layer reports changes, and doesn't grow with its history."""
+from models.itemlayer import ItemLayer
+from models.items import HealingPotion
+from models.level import Level
+from models.position import at
+from rnd.dice import Rng
+
+def test_changed():
+    layer = ItemLayer()
+    potion = HealingPotion()
+    layer.add(at(10), potion)
+    version = layer.version
+    layer.add(at(20), HealingPotion())
+    layer.remove(at(10), potion)
+    assert sorted(layer.changed(version)) == [10, 20]
+    assert layer.changed(layer.version) == []
+
+def test_history_is_bounded():
+    layer = ItemLayer()
+    version = layer.version
+    for offset in range(1000):
+        layer.add(at(offset), HealingPotion())
+        layer.pop(at(offset))
+    assert len(layer._changed) <= ItemLayer.MAX_EMPTIED + 1
+    # Too old to list: the caller must redraw everything
+    assert layer.changed(version) is None
+    recent = layer.version
+    layer.add(at(5), HealingPotion())
+    assert layer.changed(recent) == [5]
+
+def test_squares_follow_the_layer():
+    level = Level(rng=Rng(0))
+    pos, square = next(level.squares())
+    potion = HealingPotion()
+    level.items.add(pos, potion)
+    assert square.items == (potion,)
+    # Squares taken out of the level keep their items
+    feature = level.locate(pos)
+    del feature[pos]
+    assert level.items.at(pos) == ()
+    assert square.items == (potion,)
+    feature[pos] = square
+    assert level.items.at(pos) == (potion,)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""LevelList pages levels out to disk, but never the player's."""
+from helpers.i18n import EnglishDescriptionFactory
+from models import savegame
+from models.game import Game, LevelList, LevelSupply
+
+def _game(seed: int = 1, max_resident: int = LevelList.MAX_RESIDENT) -> Game:
+    return Game(EnglishDescriptionFactory(), seed, LevelSupply(seed), LevelList(max_resident=max_resident))
+
+def test_iterating_keeps_the_players_level():
+    game = _game()
+    for __ in range(5):
+        game.descend()
+    level = game.player.level
+    for __ in game.levels:
+        pass
+    assert game.levels.evictions > 0
+    assert game.levels[game.depth] is level
+    game.descend()
+    assert game.depth == 6
+
+def test_single_resident_level():
+    game = _game(max_resident=1)
+    for __ in range(3):
+        game.descend()
+    for depth in range(len(game.levels)):
+        assert game.levels[depth] is not None
+    assert game.player.level is game.levels[3]
+    game.descend()
+    assert game.depth == 4
+
+def test_restored_game_keeps_the_players_level():
+    game = _game()
+    for __ in range(5):
+        game.descend()
+    restored = savegame.loads(savegame.dumps(game), EnglishDescriptionFactory(), levels=LevelList(max_resident=2))
+    for __ in restored.levels:
+        pass
+    restored.descend()
+    assert restored.depth == 6
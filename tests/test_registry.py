@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Registry ids are stored in save files and command logs: they must not change."""
+import pytest
+
+from helpers.commands import Command
+from models.items import Item
+
+COMMAND_IDS = {
+    0: "Move", 1: "AddInventoryQuery", 2: "Quaff", 3: "Pickup", 4: "ShowInventory", 5: "Descend",
+    6: "ShowCommandStats", 7: "ProfileNextTurn", 8: "AddMessage", 9: "AddPopup", 10: "Heal",
+}
+ITEM_IDS = {
+    0: "HasEffect", 1: "SingleUse", 2: "Potion", 3: "Scroll", 4: "HealingScroll", 5: "HealingPotion",
+}
+
+@pytest.mark.parametrize("base, ids", [(Command, COMMAND_IDS), (Item, ITEM_IDS)])
+def test_ids_are_stable(base, ids):
+    registered = {registry_id: cls.__name__ for registry_id, cls in base.registry.items()}
+    # New classes may be added, but existing ids keep their class
+    assert {registry_id: registered.get(registry_id) for registry_id in ids} == ids
+
+def test_command_ids_fit_the_log():
+    assert all(0 <= registry_id < 255 for registry_id in Command.registry)
+
+def test_duplicate_id():
+    with pytest.raises(ValueError):
+        class Duplicate(Item, registry_id=2):
+            pass
+    assert Item.registry[2].__name__ == "Potion"
+
+def test_missing_id():
+    with pytest.raises(TypeError):
+        class Anonymous(Command):
+            pass
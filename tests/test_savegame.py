@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""A restored game must be the same game as the one that was saved."""
+from itertools import islice
+
+import pytest
+
+from helpers.i18n import EnglishDescriptionFactory
+from models import savegame
+from models.game import Game, LevelSupply
+from models.items import Beatitude, HealingPotion, HealingScroll
+from models.level import Level
+from rnd.dice import Rng
+from ui.headless import HeadlessInterface, random_keys
+
+SEEDS = range(4)
+
+def _item(item) -> tuple:
+    return type(item), item.beatitude, item.beatitude_known
+
+def _level(level: Level) -> dict:
+    features = {id(feature): i for i, feature in enumerate(level.features)}
+    return {
+        "rooms": [(room.bbox, room.lit) for room in level.rooms],
+        "corridors": len(level.corridors),
+        "squares": {pos: (square.type, features[id(level.locate(pos))]) for pos, square in level.squares()},
+        "known": level.visibility.known,
+        "lit": level.visibility.lit,
+        "items": {pos: [_item(item) for item in stack] for pos, stack in level.items.all()},
+    }
+
+def _player(game: Game) -> dict:
+    player = game.player
+    inventory = player.inventory
+    return {
+        "name": player.name,
+        "pos": player.pos,
+        "depth": game.depth,
+        "hp": (player.health.current_hp, player.health.max_hp),
+        "speed": player.speed,
+        "energy": player.energy,
+        "inventory": {slot: [_item(item) for item in inventory.stack(slot)] for slot in inventory},
+    }
+
+def _game(game: Game) -> dict:
+    descriptions = game.descriptions
+    return {
+        "seed": game.seed,
+        "levels_seed": game.level_supply.rng.initial_seed,
+        "rng": game.rng.getstate(),
+        "turn": game.turn,
+        "time": game.scheduler.time,
+        "player_time": game.scheduler.when(game.player),
+        "unknown_items": dict(descriptions.unknown_items),
+        "known_items": set(descriptions.known_items),
+        "messages": [msg for msg in game.messages if isinstance(msg, str)],
+        "player": _player(game),
+    }
+
+def _assert_same(game: Game, restored: Game) -> None:
+    assert _game(restored) == _game(game)
+    assert len(restored.levels) == len(game.levels)
+    for depth in range(len(game.levels)):
+        assert _level(restored.levels[depth]) == _level(game.levels[depth]), depth
+
+def _played(seed: int) -> Game:
+    game = Game(EnglishDescriptionFactory(), seed, LevelSupply(seed))
+    interface = HeadlessInterface(game, Rng(seed).split("keys"))
+    interface.play(islice(random_keys(interface.rng, 50), 600))
+    # Random play rarely keeps items, so add some of every kind
+    cursed = HealingPotion()
+    cursed.beatitude, cursed.beatitude_known = Beatitude.CURSED, True
+    for item in HealingScroll(), HealingScroll(), cursed:
+        game.player.inventory.add(item)
+    blessed = HealingScroll()
+    blessed.beatitude = Beatitude("blessed")
+    game.player.level.items.add(game.player.pos, blessed)
+    game.descriptions.known_items.add(HealingScroll)
+    return game
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_restored_game_is_identical(seed):
+    game = _played(seed)
+    restored = savegame.loads(savegame.dumps(game), EnglishDescriptionFactory())
+    _assert_same(game, restored)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_restored_game_plays_identically(seed):
+    game = _played(seed)
+    restored = savegame.loads(savegame.dumps(game), EnglishDescriptionFactory())
+    for g in game, restored:
+        interface = HeadlessInterface(g, Rng(seed).split("answers"))
+        interface.play(islice(random_keys(Rng(seed).split("more keys"), 30), 300))
+    _assert_same(game, restored)
+
+def test_save_file(tmp_path):
+    game = _played(0)
+    path = str(tmp_path / "game.sav")
+    savegame.save(game, path)
+    restored = savegame.load(path, EnglishDescriptionFactory())
+    _assert_same(game, restored)
+
+def test_rejects_other_versions():
+    data = bytearray(savegame.dumps(_played(0)))
+    data[4] += 1
+    with pytest.raises(savegame.SaveFormatError):
+        savegame.loads(bytes(data), EnglishDescriptionFactory())
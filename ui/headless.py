@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Headless game engine.
+
+Drives a Game without a terminal, from a scripted or random key stream.
+Used for soak tests and for measuring the game's throughput. This module
+must not import asciimatics.
+"""
+import tracemalloc
+from collections import namedtuple
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+from time import perf_counter
+from typing import Iterable, Iterator, List, Optional
+
+from helpers.commands import Command, Descend
+from helpers.i18n import EnglishDescriptionFactory
+from models.game import Game, InventoryQuery, LevelList, LevelSupply
+from rnd.dice import Rng
+from ui.keymap import KEYMAP
+
+class GameStats(namedtuple("GameStats", "seed turns levels seconds memory evictions reloads")):
+    """Outcome of a headless game.
+
+    `memory` is the number of bytes allocated by the game, or None
+    if it wasn't measured. `evictions` and `reloads` count the levels
+    paged out to and back in from the level cache."""
+    pass
+
+class HeadlessInterface():
+    """Plays a game from a key stream.
+
+    Keys are the same as the text interface's, plus '>' to descend to
+    the next level. Messages and popups are discarded; inventory queries
+    are answered at random."""
+    keymap = dict(KEYMAP)
+    keymap[ord('>')] = Descend()
+
+    def __init__(self, game: Game, rng: Optional[Rng] = None):
+        self.game = game
+        self.rng = rng or Rng(game.seed)
+        self.turns = 0
+        """Number of commands sent to the game."""
+
+    def send(self, cmd: Command) -> None:
+        """Sends a command to the game and handles its outcome."""
+        self.game.add_command(cmd)
+        self.turns += 1
+        messages = self.game.messages
+        while messages:
+            msg = messages.pop()
+            if isinstance(msg, InventoryQuery):
+                msg.execute(self.rng.choice([None] + [item for __, item in msg.items]))
+
+    def press(self, key: int) -> None:
+        """Simulates a key press. Unbound keys are ignored."""
+        cmd = self.keymap.get(key)
+        if cmd is not None:
+            self.send(cmd)
+
+    def play(self, keys: Iterable[int], stop_on_death: bool = False) -> None:
+        """Presses every key in `keys`."""
+        health = self.game.player.health
+        for key in keys:
+            self.press(key)
+            if stop_on_death and health.current_hp == 0:
+                break
+
+def random_keys(rng: Rng, descend_every: int = 0) -> Iterator[int]:
+    """Yields random keys of the text interface forever.
+
+    :param descend_every: if not 0, about one key every `descend_every`
+        is '>' instead."""
+    keys = sorted(KEYMAP)
+    while True:
+        if descend_every and rng.randrange(descend_every) == 0:
+            yield ord('>')
+        else:
+            yield rng.choice(keys)
+
+def run_game(seed: int, turns: int, script: Optional[str] = None, descend_every: int = 0,
+             stop_on_death: bool = False, measure_memory: bool = False,
+             resident_levels: Optional[int] = None) -> GameStats:
+    """Plays a whole game in this process.
+
+    :param script: keys to press. If None, random keys are used.
+    :param measure_memory: trace allocations (this slows the game down).
+    :param resident_levels: see `LevelList.max_resident`."""
+    if measure_memory:
+        tracemalloc.start()
+    start = perf_counter()
+    levels = LevelList(max_resident=resident_levels)
+    game = Game(EnglishDescriptionFactory(), seed, LevelSupply(seed, workers=0), levels)
+    interface = HeadlessInterface(game, Rng(seed).split("keys"))
+    keys = (ord(c) for c in script) if script is not None else random_keys(interface.rng, descend_every)
+    interface.play(islice(keys, turns), stop_on_death)
+    seconds = perf_counter() - start
+    memory = None
+    if measure_memory:
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return GameStats(seed, interface.turns, len(levels), seconds, memory, levels.evictions, levels.reloads)
+
+def _run_game(args: tuple) -> GameStats:
+    return run_game(*args)
+
+def run_batch(games: int, turns: int, seed: int = 0, workers: Optional[int] = None,
+              script: Optional[str] = None, descend_every: int = 0,
+              stop_on_death: bool = False, resident_levels: Optional[int] = None) -> List[GameStats]:
+    """Plays `games` games in parallel, one process per CPU core by default.
+
+    Game `i` is seeded with `seed + i`. Only the first game traces its
+    memory, so its timing is not representative."""
+    jobs = [(seed + i, turns, script, descend_every, stop_on_death, i == 0, resident_levels) for i in range(games)]
+    with Pool(workers) as pool:
+        return pool.map(_run_game, jobs, chunksize=max(1, games // (4 * cpu_count())))
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""Key bindings shared by the user interfaces."""
+from models.direction import Direction
+from models.items import Potion
+from helpers.commands import *
+
+KEYMAP = {
+    ord('h'): Move(Direction.W),
+    ord('j'): Move(Direction.S),
+    ord('k'): Move(Direction.N),
+    ord('l'): Move(Direction.E),
+    ord('y'): Move(Direction.NW),
+    ord('u'): Move(Direction.NE),
+    ord('b'): Move(Direction.SW),
+    ord('n'): Move(Direction.SE),
+    ord('q'): AddInventoryQuery(Quaff, Potion),
+    ord(','): Pickup(),
+    ord('i'): ShowInventory()
+}
+"""Maps key codes to commands."""
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 from collections import deque
 from functools import partial
-from time import sleep
-from typing import Tuple
+from time import sleep, perf_counter
+from typing import Tuple, Dict
 
 from asciimatics.screen import Screen, NextScene
 from asciimatics.widgets import Button, PopUpDialog, ListBox, Frame, Layout, Widget, Label
@@ -10,12 +10,15 @@ from asciimatics.event import KeyboardEvent, MouseEvent
 from asciimatics.scene import Scene
 from asciimatics.effects import Effect
 
+from models.events import Moved
 from models.game import Game, Popup, InventoryQuery
 from models.level import Level, SquareType
 from models.player import Player
+from models.position import Position, at
+from models.visibility import offsets, to_bytes
 from models.items import Potion, Scroll, HealingPotion
-from models.direction import Direction
 from helpers.commands import *
+from ui.keymap import KEYMAP
 
 class BasicEffect(Effect):
     """Implements some abstract methods."""
@@ -172,6 +175,62 @@ class StatusBar(BasicEffect):
             self._top_left[0], self._top_left[1] + 1,
             color, Screen.A_BOLD)
 
+class FrameBuffer():
+    """Remembers the glyph, colour and attribute last drawn on each cell.
+
+    Cells are queued with `put`; `flush` only sends the ones that differ
+    from what is already on screen, and merges contiguous cells of a row
+    that share colour and attribute into a single `print_at` call."""
+    def __init__(self, screen: Screen):
+        self._screen = screen
+        self._cells = {}    # type: Dict[Tuple[int, int], Tuple[str, int, int]]
+        self._pending = {}  # type: Dict[Tuple[int, int], Tuple[str, int, int]]
+        self.valid = False
+        """When False, the screen content is unknown and everything must be redrawn."""
+        self.cells_drawn = 0
+        """Number of cells drawn in the last frame."""
+        self.print_calls = 0
+        """Number of `print_at` calls in the last frame."""
+        self.frame_time = 0.0
+        """Seconds spent flushing the last frame."""
+
+    def invalidate(self) -> None:
+        """Forgets what is on screen."""
+        self._cells.clear()
+        self.valid = False
+
+    def put(self, col: int, row: int, char: str, colour: int, attr: int) -> None:
+        """Queues a cell for the next flush."""
+        cell = (char, colour, attr)
+        if self._cells.get((col, row)) != cell:
+            self._pending[(col, row)] = cell
+        else:
+            self._pending.pop((col, row), None)
+
+    def flush(self) -> None:
+        """Draws the queued cells that changed."""
+        start = perf_counter()
+        calls = 0
+        run, run_col, run_row, run_style = [], None, None, None
+        for (col, row) in sorted(self._pending, key=lambda pos: (pos[1], pos[0])):
+            char, colour, attr = self._pending[(col, row)]
+            if run and row == run_row and col == run_col + len(run) and (colour, attr) == run_style:
+                run.append(char)
+                continue
+            if run:
+                self._screen.print_at(''.join(run), run_col, run_row, *run_style)
+                calls += 1
+            run, run_col, run_row, run_style = [char], col, row, (colour, attr)
+        if run:
+            self._screen.print_at(''.join(run), run_col, run_row, *run_style)
+            calls += 1
+        self._cells.update(self._pending)
+        self.cells_drawn = len(self._pending)
+        self.print_calls = calls
+        self._pending.clear()
+        self.valid = True
+        self.frame_time = perf_counter() - start
+
 class MapBox(BasicEffect):
     chars = {
         SquareType.ROOM: '.',
@@ -187,19 +246,10 @@ class MapBox(BasicEffect):
         Scroll: '?'
     }
 
-    commands = {
-        ord('h'): Move(Direction.W),
-        ord('j'): Move(Direction.S),
-        ord('k'): Move(Direction.N),
-        ord('l'): Move(Direction.E),
-        ord('y'): Move(Direction.NW),
-        ord('u'): Move(Direction.NE),
-        ord('b'): Move(Direction.SW),
-        ord('n'): Move(Direction.SE),
-        ord('q'): AddInventoryQuery(Quaff, Potion),
-        ord(','): Pickup(),
-        ord('i'): ShowInventory()
-    }
+    commands = dict(KEYMAP)
+    # Debug keys
+    commands[Screen.KEY_F11] = ProfileNextTurn("turn.prof")
+    commands[Screen.KEY_F12] = ShowCommandStats()
 
     color = {
         True: Screen.COLOUR_WHITE,
@@ -210,18 +260,73 @@ class MapBox(BasicEffect):
         self._screen = screen
         self._top_left = top_left
         self.game = game
+        self.buffer = FrameBuffer(screen)
+        self._level = None
+        self._player_pos = None
+        self._drawn = None
+        """Snapshot of the level's Visibility layer at the last frame."""
+        self._items_drawn = 0
+        """Version of the level's ItemLayer at the last frame."""
+        self._dirty = set()
+        """Positions whose content changed since the last frame."""
+        game.events.subscribe(Moved, self._on_moved)
         return super().__init__(screen, **kwargs)
 
+    def _on_moved(self, event: Moved):
+        self._dirty.add(event.old)
+
     def update(self, frame_no):
         self.draw_level()
         self.draw_player()
+        self.buffer.flush()
 
     def draw_level(self):
-        """Draws the current level."""        
-        for pos, sq in self.game.player.level.squares():
-            pos += self._top_left
-            if sq.known:# and self._can_draw(pos):
-                self.draw_square(pos, sq)
+        """Draws the current level.
+
+        After the first frame, only the squares whose known or lit flags
+        or items changed, the squares the player left and the one under
+        the player are considered. Full redraws only look up items on
+        the squares that hold some."""
+        level = self.game.player.level
+        if level is not self._level:
+            if self._level is not None:
+                self.clear()
+            self._level = level
+            self.buffer.invalidate()
+        visibility = level.visibility
+        drawn, self._drawn = self._drawn, visibility.snapshot()
+        known, lit = self._drawn
+        items, items_drawn, self._items_drawn = level.items, self._items_drawn, level.items.version
+        items_changed = items.changed(items_drawn) if self.buffer.valid else ()
+        if items_changed is None:
+            self.buffer.invalidate()
+        if self.buffer.valid:
+            positions = self._dirty
+            if self._player_pos is not None:
+                positions.add(self._player_pos)
+            positions.update(map(at, offsets(visibility.changed(drawn))))
+            positions.update(map(at, items_changed))
+            for pos in positions:
+                try:
+                    sq = level[pos]
+                except KeyError:
+                    continue
+                offset = pos.offset
+                if known >> offset & 1:# and self._can_draw(pos):
+                    self.draw_square(pos + self._top_left, sq, lit >> offset & 1, items.at(pos))
+        else:
+            lit_cells = to_bytes(lit)
+            for offset in offsets(known):
+                pos = at(offset)
+                self.draw_square(pos + self._top_left, level[pos], lit_cells[offset], ())
+            for pos, stack in items.in_mask(known):
+                self.draw_square(pos + self._top_left, level[pos], lit_cells[pos.offset], stack)
+        self._dirty.clear()
+
+    def clear(self):
+        """Blanks the map area."""
+        for row in range(Position.SCREEN_H):
+            self._screen.print_at(' ' * Position.SCREEN_W, self._top_left[0], self._top_left[1] + row)
 
     def _can_draw(self, pos):
         """Checks if the position can be drawn over.
@@ -235,22 +340,29 @@ class MapBox(BasicEffect):
     def draw_player(self):
         """Draws the player."""
         pos = self.game.player.pos
-        self._screen.print_at('@', *(pos + self._top_left), colour=Screen.COLOUR_WHITE, attr=Screen.A_REVERSE)
+        self._player_pos = pos
+        self.buffer.put(*(pos + self._top_left), '@', Screen.COLOUR_WHITE, Screen.A_REVERSE)
 
-    def draw_square(self, pos, square):
-        if square.items:
-            char = self.chars[square.items[0].category]
+    def draw_square(self, pos, square, lit=None, items=None):
+        if lit is None:
+            lit = square.lit
+        if items is None:
+            items = square.items
+        if items:
+            char = self.chars[items[0].category]
         else:
             char = self.chars[square.type]
-        self._screen.print_at(
-            char,
+        self.buffer.put(
             pos.col,
             pos.row,
-            self.color[square.lit],
+            char,
+            self.color[bool(lit)],
             Screen.A_BOLD
         )
+
     def reset(self):
-        pass
+        # The scene was cleared or drawn over
+        self.buffer.invalidate()
 
     def process_event(self, event):
         try: